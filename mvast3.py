@@ -13,6 +13,21 @@ import numpy as np
 import random
 import webbrowser
 import shutil
+import hashlib
+import argparse
+import glob
+import math
+import functools
+import bisect
+import itertools
+import heapq
+import json
+import threading
+import sqlite3
+import platform
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import tkinter as tk
 from tkinter import filedialog, messagebox
@@ -29,7 +44,7 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
 
     full_path = os.path.join(base_path, relative_path)
-    print(f"DEBUG: Trying to load resource from: {full_path}")
+    log(f"DEBUG: Trying to load resource from: {full_path}")
     return full_path
     
 # --- Application Constants ---
@@ -48,6 +63,10 @@ DEFAULT_LOG_DIR_PARTICIPANT = os.path.join(DEFAULT_LOG_DIR_BASE, DEFAULT_LOG_DIR
 
 SCHEDULES_SUBDIR = "randomization_schedules"
 SETUPS_SUBDIR = "experiment_setups"
+CATALOG_NAME = "mvast3_catalog.sqlite"
+CATALOG_PATH = os.path.join(DEFAULT_LOG_DIR_BASE, CATALOG_NAME)
+CATALOG_BUSY_TIMEOUT_S = 10.0 # how long a write waits for another station's transaction
+FRAME_CACHE_SUBDIR = "frame_cache"
 HELP_FILE_NAME = "mvast3_manual.html" 
 
 DEFAULT_STIMULUS_DURATION = 10.0
@@ -67,6 +86,74 @@ GRAY_COLOR = (150, 150, 150)
 
 PYGAME_REFERENCE_SCREEN_HEIGHT = 1080.0
 
+STIMULUS_SOURCE_IMAGES = "images"
+STIMULUS_SOURCE_GENERATED = "generated"
+CHECKER_COLOR_PAIRS = {"bw": (WHITE, BLACK), "by": ((255, 255, 0), (0, 0, 255)), "rg": ((255, 0, 0), (0, 255, 0))}
+CHECKER_LAYOUTS = ("grid", "radial", "annular") # radial = polar rings x wedges; annular = concentric rings
+CHECKER_UNITS = ("px", "deg")
+DEFAULT_CHECK_SIZE_PX = 50 # matches the shipped checker_*.png at 1600x1200
+DEFAULT_CHECKER_WEDGES = 24
+DEFAULT_VIEWING_DISTANCE_CM = 57.0 # 1 cm on screen ~ 1 degree of visual angle
+DEFAULT_SCREEN_WIDTH_CM = 53.0
+
+# frame_sequence column: '|'-separated frames, each '1', '2', 'blank' or an image path, with an optional ':hold'
+# in seconds (or 'ms'). Frames without a hold last one reversal period, 1 / (2 * checkerboard_hz).
+FRAME_SEQUENCE_SEPARATOR = "|"
+FRAME_BLANK = "blank"
+DEFAULT_FRAME_SEQUENCE = (("1", None), ("2", None))
+STATIC_FRAME_SEQUENCE = (("1", None),)
+
+# Master CSVs are compiled into a typed trial plan, cached next to the CSV as <name>.plan.npz keyed by content hash
+TRIAL_PLAN_VERSION = 1
+TRIAL_PLAN_SUFFIX = ".plan.npz"
+TRIAL_PLAN_REQUIRED = ('trial_number', 'brightness_factor', 'stimulus_duration', 'fixation_duration', 'checkerboard_hz')
+TRIAL_PLAN_DTYPE = np.dtype([('trial_number', 'i4'), ('block_number', 'i4'), ('trial_in_block', 'i4'), ('brightness_factor', 'f8'),
+                             ('stimulus_duration', 'f8'), ('fixation_duration', 'f8'), ('checkerboard_hz', 'f8')])
+TRIAL_PLAN_LIMITS = {'trial_number': (lambda v: v >= 1, "must be at least 1"),
+                     'block_number': (lambda v: v >= 0, "must not be negative"),
+                     'trial_in_block': (lambda v: v >= 1, "must be at least 1"),
+                     'brightness_factor': (lambda v: v >= 0, "must not be negative"),
+                     'stimulus_duration': (lambda v: v > 0, "must be positive"),
+                     'fixation_duration': (lambda v: v >= 0, "must not be negative")}
+TRIAL_PLAN_ERRORS_SHOWN = 25 # the error dialog lists this many problems, then a count of the rest
+
+STIMULUS_CACHE_BYTE_BUDGET = 768 * 1024 * 1024 # ~24 full-screen 4K surfaces
+FRAME_CACHE_DIR = os.path.join(DEFAULT_LOG_DIR_BASE, FRAME_CACHE_SUBDIR)
+FRAME_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024 # ~120 pre-scaled 4K frames
+
+FRAME_SPIN_WINDOW_S = 0.0015 # busy-wait this long before each flip deadline
+RATING_TRAJECTORY_CAPACITY = 8192 # input events kept per rating screen; extra events are counted, not stored
+RATING_SCALE_CODES = {"unpleasantness": 1, "brightness": 2}
+RATING_TRAJECTORY_MAGIC = b"MVRT\x01\x00\x00\x00"
+# One sidecar record per input event: times are ms since the rating screen's first flip
+RATING_RECORD_DTYPE = np.dtype([('trial', '<u4'), ('scale', 'u1'), ('event', 'u1'), ('value', '<i2'),
+                                ('x', '<i4'), ('t_ms', '<f4')])
+# Trial columns of data_P*.csv and their types in the columnar session export (empty cells: NaN for floats, -1 for ints)
+SESSION_COLUMNS = (('Trial_Number_Overall', 'i4'), ('Block_Number', 'i4'), ('Trial_In_Block', 'i4'),
+                   ('Brightness_Factor', 'f8'), ('Stimulus_Duration_s', 'f8'), ('Fixation_Duration_s', 'f8'),
+                   ('Checkerboard_Hz', 'f8'), ('Discomfort_Rating_0_100', 'i4'), ('Brightness_Rating_0_100', 'i4'),
+                   ('Response_Timestamp', 'U'), ('Achieved_Hz', 'f8'), ('Stimulus_Frames', 'i4'), ('Hold_Frames', 'U'),
+                   ('Mean_Achieved_Hz', 'f8'), ('Max_Interval_Error_ms', 'f8'), ('Dropped_Flips', 'i4'), ('Frame_Sequence', 'U'),
+                   ('Discomfort_First_Touch_ms', 'f8'), ('Discomfort_Confirm_ms', 'f8'),
+                   ('Brightness_First_Touch_ms', 'f8'), ('Brightness_Confirm_ms', 'f8'))
+SESSION_METADATA_KEY = b"mvast3.session" # Parquet schema metadata key / .npz entry holding the preamble as JSON
+TEXT_CACHE_MAX_ENTRIES = 512 # rendered text surfaces kept (rating labels, value readouts 0-100, messages)
+EVENT_WAIT_SLACK_S = 0.002 # blocking event waits can wake this late; stop blocking early and let the spin absorb it
+FRAME_LATE_TOLERANCE_S = 0.002 # a flip later than this past its deadline counts as missed
+FRAME_MISS_POLICY = "skip" # "skip": drop late frames to stay phase-locked; "late": flip late, keep every frame
+JOURNAL_FSYNC_POLICIES = ("trial", "session", "off") # fsync after every trial record / only at start and end / never
+JOURNAL_FSYNC_POLICY = "trial"
+WRITER_QUEUE_SIZE = 256 # pending background writes/log lines before submit() blocks the session thread
+
+PRESENTATION_TIMED = "timed" # wall-clock FrameScheduler timing (default)
+PRESENTATION_VSYNC = "vsync" # refresh-locked: durations and flicker half-periods in whole display frames
+VSYNC_MEASURE_FRAMES = 60
+VSYNC_MIN_PERIOD_S = 1.0 / 500 # flips returning faster than this are not blocking on vsync
+VSYNC_HZ_TOLERANCE = 0.005 # relative flicker-rate error still treated as exact
+
+RENDERER_SURFACE = "surface" # classic display surface; brightness variants are pre-built surfaces (default)
+RENDERER_SDL2 = "sdl2" # pygame._sdl2 Window/Renderer/Texture; brightness is texture colour modulation at draw time
+
 # --- Main Application Class ---
 class MVAST3Application:
     def __init__(self):
@@ -287,8 +374,8 @@ class SetupGeneratorWindow:
         self.window.title("M-VAST 3 - Generate Experiment Setup")
         
         # Set geometry BEFORE creating widgets
-        self.window.geometry("700x750")
-        self.window.minsize(650, 700)
+        self.window.geometry("700x840")
+        self.window.minsize(650, 790)
         
         # Force the window to fully initialize before adding content
         self.window.update_idletasks()
@@ -316,6 +403,7 @@ class SetupGeneratorWindow:
         self.fix_dur_var = tk.DoubleVar(value=DEFAULT_FIXATION_DURATION)
         self.hz_var = tk.DoubleVar(value=DEFAULT_CHECKERBOARD_HZ)
         self.rand_blocks_var = tk.IntVar(value=DEFAULT_RANDOMIZED_BLOCKS_COUNT)
+        self.frame_seq_var = tk.StringVar(value="")
         
     def create_setup_gui(self):
         # Create main scrollable container in case window is small
@@ -530,6 +618,28 @@ class SetupGeneratorWindow:
             foreground="gray"
         ).grid(row=3, column=2, padx=(10, 5), pady=8, sticky="w")
         
+        # Row 4: Frame Sequence (blank = classic two-board flicker)
+        ttk.Label(
+            self.custom_params_frame, 
+            text="Frame Sequence (optional):", 
+            font=lbl_font
+        ).grid(row=4, column=0, padx=(5, 10), pady=8, sticky="w")
+        
+        self.frame_seq_entry = ttk.Entry(
+            self.custom_params_frame, 
+            textvariable=self.frame_seq_var, 
+            width=30, 
+            font=entry_font
+        )
+        self.frame_seq_entry.grid(row=4, column=1, columnspan=2, padx=5, pady=8, sticky="we")
+        
+        ttk.Label(
+            self.custom_params_frame, 
+            text="e.g. 1|2|blank:0.1  (frames: 1, 2, blank or image path; optional :hold in s or ms)", 
+            font=small_font,
+            foreground="gray"
+        ).grid(row=5, column=0, columnspan=3, padx=(5, 5), pady=(0, 8), sticky="w")
+        
         self.custom_params_frame.update_idletasks()
         
         # ============================================================
@@ -589,7 +699,8 @@ class SetupGeneratorWindow:
             self.stim_dur_spinbox, 
             self.fix_dur_spinbox, 
             self.hz_spinbox, 
-            self.rand_blocks_spinbox
+            self.rand_blocks_spinbox,
+            self.frame_seq_entry
         ]
         
         if mode == "Custom":
@@ -601,6 +712,7 @@ class SetupGeneratorWindow:
             self.fix_dur_var.set(DEFAULT_FIXATION_DURATION)
             self.hz_var.set(DEFAULT_CHECKERBOARD_HZ)
             self.rand_blocks_var.set(DEFAULT_RANDOMIZED_BLOCKS_COUNT)
+            self.frame_seq_var.set("")
         
         for widget in widgets_to_toggle:
             try:
@@ -647,6 +759,7 @@ class SetupGeneratorWindow:
             f"  • Ramp-up: {RAMP_UP_TRIALS_COUNT} trials (brightness: {brightness_str})\n"
             f"  • Randomized: {int(blocks)} blocks × {TRIALS_PER_BLOCK} trials = {rand_trials} trials\n"
             f"  • Per trial: Stimulus={float(stim):.1f}s, Fixation={float(fix):.1f}s, Freq={float(hz):.1f}Hz\n"
+            f"  • Frame sequence: {self.frame_seq_var.get().strip() or '1|2 (alternating)'}\n"
             f"Output: Master trial CSV in '{SETUPS_SUBDIR}/', schedule in '{SCHEDULES_SUBDIR}/'"
         )
         
@@ -718,6 +831,8 @@ class SetupGeneratorWindow:
                     raise ValueError("Frequency must be between 0.1 and 60 Hz.")
                 if not (1 <= b <= 20):
                     raise ValueError("Number of randomized blocks must be between 1 and 20.")
+                seq = parse_frame_sequence(self.frame_seq_var.get())
+                if seq: resolve_frame_holds(seq, h, s)
                     
             except tk.TclError:
                 messagebox.showerror(
@@ -750,14 +865,17 @@ class SetupGeneratorWindow:
                 "stim_duration": self.stim_dur_var.get(),
                 "fixation_duration": self.fix_dur_var.get(),
                 "hz": self.hz_var.get(),
-                "randomized_blocks": self.rand_blocks_var.get()
+                "randomized_blocks": self.rand_blocks_var.get(),
+                "frame_sequence": self.frame_seq_var.get().strip()
             }
 
     def get_or_create_brightness_schedule(self, num_rand_blocks):
         """Load existing brightness schedule or create a new one."""
         sched_dir = os.path.join(self.log_dir_base, SCHEDULES_SUBDIR)
         os.makedirs(sched_dir, exist_ok=True)
-        sched_file = os.path.join(sched_dir, f"{self.exp_id}_brightness_schedule.csv")
+        registered = self.catalog.latest_schedule(self.exp_id)
+        sched_file = self.schedule_file = (registered if registered and os.path.exists(registered)
+                                           else os.path.join(sched_dir, f"{self.exp_id}_brightness_schedule.csv"))
         
         factors = []
         expected_len = TRIALS_PER_BLOCK * num_rand_blocks
@@ -823,7 +941,7 @@ class SetupGeneratorWindow:
         return factors
 
     def generate_master_trial_csv(self, full_brightness_schedule, params):
-        """Generate the master trial CSV file."""
+        """Generate the master trial CSV file. Returns its path, or False on failure."""
         setups_dir = os.path.join(self.log_dir_base, SETUPS_SUBDIR)
         os.makedirs(setups_dir, exist_ok=True)
         master_file = os.path.join(setups_dir, f"{self.exp_id}_master_trials.csv")
@@ -835,7 +953,8 @@ class SetupGeneratorWindow:
             'brightness_factor',
             'stimulus_duration', 
             'fixation_duration', 
-            'checkerboard_hz'
+            'checkerboard_hz',
+            'frame_sequence'
         ]
         
         try:
@@ -847,6 +966,7 @@ class SetupGeneratorWindow:
                 stim_dur = params.get("stim_duration", DEFAULT_STIMULUS_DURATION)
                 fix_dur = params.get("fixation_duration", DEFAULT_FIXATION_DURATION)
                 hz = params.get("hz", DEFAULT_CHECKERBOARD_HZ)
+                frame_seq = params.get("frame_sequence", "")
                 
                 for i, bf in enumerate(full_brightness_schedule):
                     trial_num = i + 1
@@ -866,7 +986,8 @@ class SetupGeneratorWindow:
                         f"{bf:.2f}",
                         stim_dur, 
                         fix_dur, 
-                        hz
+                        hz,
+                        frame_seq
                     ])
             
             messagebox.showinfo(
@@ -874,7 +995,7 @@ class SetupGeneratorWindow:
                 f"Master CSV ({len(full_brightness_schedule)} trials) generated:\n\n{master_file}", 
                 parent=self.window
             )
-            return True
+            return master_file
             
         except Exception as e:
             import traceback
@@ -905,6 +1026,7 @@ class SetupGeneratorWindow:
         
         # Get parameters
         params = self.get_current_params()
+        self.catalog = ExperimentCatalog(CATALOG_PATH) # the runner's catalog, whatever output folder is chosen here
         
         # Get or create brightness schedule
         rand_bf = self.get_or_create_brightness_schedule(int(params["randomized_blocks"]))
@@ -926,8 +1048,13 @@ class SetupGeneratorWindow:
             )
             return
         
-        # Generate the master trial CSV
-        self.generate_master_trial_csv(full_schedule, params)
+        # Generate the master trial CSV and index it (with its schedule) by content hash
+        master_file = self.generate_master_trial_csv(full_schedule, params)
+        if master_file:
+            self.catalog.register_schedule(self.exp_id, self.schedule_file, len(rand_bf))
+            self.catalog.register_setup(self.exp_id, master_file, len(full_schedule), params, self.schedule_file)
+            try: load_trial_plan(master_file) # compiled and cached now, so the first participant's run skips it
+            except ValueError as ve: messagebox.showerror("CSV Error", str(ve), parent=self.window)
 
 # --- Experiment Runner Window (Fixed geometry) ---
 class ExperimentRunnerWindow:
@@ -935,8 +1062,8 @@ class ExperimentRunnerWindow:
         self.parent = parent; self.app = app
         self.window = ttk.Toplevel(parent)
         self.window.title("M-VAST 3 - Run Experiment")
-        self.window.geometry("800x700")
-        self.window.minsize(700, 650)
+        self.window.geometry("820x880")
+        self.window.minsize(760, 820)
         self.window.grab_set()
         self.config = RunConfig() 
         self.create_runner_gui()
@@ -969,14 +1096,42 @@ class ExperimentRunnerWindow:
 
         img_frame = ttk.Labelframe(main_frame, text="Stimulus Image Files")
         img_frame.pack(fill=X, pady=(0, 10))
+        self.stimulus_source_var = tk.StringVar(value=self.config.stimulus_source)
+        src_row = ttk.Frame(img_frame); src_row.grid(row=0, column=0, columnspan=3, padx=5, pady=(5,0), sticky="w")
+        ttk.Radiobutton(src_row, text="Image files", variable=self.stimulus_source_var, value=STIMULUS_SOURCE_IMAGES,
+                        command=self.toggle_stimulus_source).pack(side=LEFT, padx=(0, 20))
+        ttk.Radiobutton(src_row, text="Generated checkerboard", variable=self.stimulus_source_var, value=STIMULUS_SOURCE_GENERATED,
+                        command=self.toggle_stimulus_source).pack(side=LEFT)
         self.img1_path_var, self.img2_path_var = tk.StringVar(), tk.StringVar()
-        ttk.Label(img_frame, text="Image 1:", font=("",lbl_font_size)).grid(row=0, column=0, padx=5, pady=5, sticky="w")
-        ttk.Entry(img_frame, textvariable=self.img1_path_var, width=40, state='readonly', font=("",lbl_font_size)).grid(row=0, column=1, padx=5, pady=5, sticky="ew")
-        ttk.Button(img_frame, text="Browse...", command=self.browse_image1, style='outline.TButton').grid(row=0, column=2, padx=5, pady=5)
-        ttk.Label(img_frame, text="Image 2:", font=("",lbl_font_size)).grid(row=1, column=0, padx=5, pady=5, sticky="w")
-        ttk.Entry(img_frame, textvariable=self.img2_path_var, width=40, state='readonly', font=("",lbl_font_size)).grid(row=1, column=1, padx=5, pady=5, sticky="ew")
-        ttk.Button(img_frame, text="Browse...", command=self.browse_image2, style='outline.TButton').grid(row=1, column=2, padx=5, pady=5)
+        ttk.Label(img_frame, text="Image 1:", font=("",lbl_font_size)).grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        ttk.Entry(img_frame, textvariable=self.img1_path_var, width=40, state='readonly', font=("",lbl_font_size)).grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+        self.img1_btn = ttk.Button(img_frame, text="Browse...", command=self.browse_image1, style='outline.TButton')
+        self.img1_btn.grid(row=1, column=2, padx=5, pady=5)
+        ttk.Label(img_frame, text="Image 2:", font=("",lbl_font_size)).grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        ttk.Entry(img_frame, textvariable=self.img2_path_var, width=40, state='readonly', font=("",lbl_font_size)).grid(row=2, column=1, padx=5, pady=5, sticky="ew")
+        self.img2_btn = ttk.Button(img_frame, text="Browse...", command=self.browse_image2, style='outline.TButton')
+        self.img2_btn.grid(row=2, column=2, padx=5, pady=5)
+
+        gen_row = ttk.Frame(img_frame); gen_row.grid(row=3, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+        self.checker_colors_var = tk.StringVar(value=self.config.checker_colors)
+        self.checker_layout_var = tk.StringVar(value=self.config.checker_layout)
+        self.check_size_var = tk.DoubleVar(value=self.config.check_size)
+        self.check_units_var = tk.StringVar(value=self.config.check_units)
+        self.viewing_distance_var = tk.DoubleVar(value=self.config.viewing_distance_cm)
+        self.screen_width_cm_var = tk.DoubleVar(value=self.config.screen_width_cm)
+        self.generator_widgets = [
+            ttk.Combobox(gen_row, textvariable=self.checker_colors_var, values=list(CHECKER_COLOR_PAIRS), state="readonly", width=4),
+            ttk.Combobox(gen_row, textvariable=self.checker_layout_var, values=list(CHECKER_LAYOUTS), state="readonly", width=8),
+            ttk.Spinbox(gen_row, textvariable=self.check_size_var, from_=0.1, to=2000, increment=1, width=6),
+            ttk.Combobox(gen_row, textvariable=self.check_units_var, values=list(CHECKER_UNITS), state="readonly", width=4),
+            ttk.Spinbox(gen_row, textvariable=self.viewing_distance_var, from_=10, to=500, increment=1, width=6),
+            ttk.Spinbox(gen_row, textvariable=self.screen_width_cm_var, from_=10, to=500, increment=1, width=6)]
+        for col, (label, widget) in enumerate(zip(["Colors:", "Layout:", "Check:", "", "View dist (cm):", "Screen width (cm):"],
+                                                  self.generator_widgets)):
+            if label: ttk.Label(gen_row, text=label, font=("",9)).pack(side=LEFT, padx=(8 if col else 0, 2))
+            widget.pack(side=LEFT)
         img_frame.columnconfigure(1, weight=1)
+        self.toggle_stimulus_source()
 
         log_dir_frame = ttk.Labelframe(main_frame, text="Participant Data Log Directory")
         log_dir_frame.pack(fill=X, pady=(0, 15))
@@ -986,6 +1141,27 @@ class ExperimentRunnerWindow:
         ttk.Button(log_dir_frame, text="Browse...", command=self.browse_log_dir_participant, style='outline.TButton').grid(row=0, column=2, padx=5, pady=5)
         log_dir_frame.columnconfigure(1, weight=1)
 
+        pres_frame = ttk.Labelframe(main_frame, text="Presentation Options")
+        pres_frame.pack(fill=X, pady=(0, 15))
+        ttk.Label(pres_frame, text="Timing Mode:", font=("",lbl_font_size)).grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        self.presentation_mode_var = tk.StringVar(value=self.config.presentation_mode)
+        ttk.Combobox(pres_frame, textvariable=self.presentation_mode_var, values=[PRESENTATION_TIMED, PRESENTATION_VSYNC],
+                     state="readonly", width=12, font=("",lbl_font_size)).grid(row=0, column=1, padx=5, pady=5, sticky="w")
+        self.vsync_strict_var = tk.BooleanVar(value=self.config.vsync_strict)
+        ttk.Checkbutton(pres_frame, text="Vsync: refuse Hz that are not whole frames", variable=self.vsync_strict_var).grid(row=0, column=2, padx=5, pady=5, sticky="w")
+        ttk.Label(pres_frame, text="Renderer:", font=("",lbl_font_size)).grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        self.renderer_backend_var = tk.StringVar(value=self.config.renderer_backend)
+        ttk.Combobox(pres_frame, textvariable=self.renderer_backend_var, values=[RENDERER_SURFACE, RENDERER_SDL2],
+                     state="readonly", width=12, font=("",lbl_font_size)).grid(row=1, column=1, padx=5, pady=5, sticky="w")
+        ttk.Label(pres_frame, text="(sdl2: textures with colour-mod brightness; runs on the software renderer)",
+                  font=("",9), foreground="gray").grid(row=1, column=2, padx=5, pady=5, sticky="w")
+        ttk.Label(pres_frame, text="Display Gamma:", font=("",lbl_font_size)).grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        self.display_gamma_var = tk.StringVar(value=f"{self.config.display_gamma:g}" if self.config.display_gamma else "")
+        ttk.Entry(pres_frame, textvariable=self.display_gamma_var, width=8, font=("",lbl_font_size)).grid(row=2, column=1, padx=5, pady=5, sticky="w")
+        ttk.Label(pres_frame, text="(blank: brightness scales RGB values; e.g. 2.2: brightness scales luminance)",
+                  font=("",9), foreground="gray").grid(row=2, column=2, padx=5, pady=5, sticky="w")
+        pres_frame.columnconfigure(2, weight=1)
+
         btn_frame = ttk.Frame(main_frame, padding=(0, 10)); btn_frame.pack(fill=X) 
         ttk.Button(btn_frame, text="Start Experiment", command=self.start_experiment, style='success.TButton', padding=(10,5)).pack(side=RIGHT)
         
@@ -993,6 +1169,12 @@ class ExperimentRunnerWindow:
         
     def back_to_main(self): self.window.destroy()
 
+    def toggle_stimulus_source(self):
+        generated = self.stimulus_source_var.get() == STIMULUS_SOURCE_GENERATED
+        for btn in (self.img1_btn, self.img2_btn): btn.config(state="disabled" if generated else "normal")
+        for widget in self.generator_widgets:
+            widget.config(state=("readonly" if isinstance(widget, ttk.Combobox) else "normal") if generated else "disabled")
+
     def browse_master_csv(self):
         init_dir = os.path.join(DEFAULT_LOG_DIR_BASE, SETUPS_SUBDIR)
         fp = filedialog.askopenfilename(parent=self.window, title="Select Master CSV", filetypes=[("CSV files", "*.csv")], initialdir=init_dir if os.path.exists(init_dir) else APP_BASE_PATH)
@@ -1017,6 +1199,10 @@ class ExperimentRunnerWindow:
         self.config.image2_path = self.img2_path_var.get()
         self.config.participant_id = self.part_id_entry.get().strip()
         self.config.log_dir_participant = self.log_dir_participant_var.get() 
+        self.config.presentation_mode = self.presentation_mode_var.get()
+        self.config.vsync_strict = self.vsync_strict_var.get()
+        self.config.renderer_backend = self.renderer_backend_var.get()
+        self.config.stimulus_source = self.stimulus_source_var.get()
 
         if not (self.config.master_csv_path and os.path.exists(self.config.master_csv_path)):
             messagebox.showerror("Input Error", "Valid Master CSV required.", parent=self.window); return False
@@ -1024,12 +1210,31 @@ class ExperimentRunnerWindow:
             messagebox.showerror("Input Error", "Participant ID required.", parent=self.window); return False
         if any(c in self.config.participant_id for c in r'/\:*?"<>|'):
             messagebox.showerror("Input Error", "Participant ID has invalid chars.", parent=self.window); return False
-        if not (self.config.image1_path and os.path.exists(self.config.image1_path)):
-            messagebox.showerror("Input Error", "Valid Image 1 required.", parent=self.window); return False
-        if not (self.config.image2_path and os.path.exists(self.config.image2_path)):
-            messagebox.showerror("Input Error", "Valid Image 2 required.", parent=self.window); return False
-        if self.config.image1_path == self.config.image2_path and \
-           not messagebox.askyesno("Warning", "Images are same (no flicker). Continue?", parent=self.window): return False
+        try:
+            gamma_text = self.display_gamma_var.get().strip()
+            self.config.display_gamma = float(gamma_text) if gamma_text else None
+            if self.config.display_gamma is not None and not (0.5 <= self.config.display_gamma <= 4.0): raise ValueError
+        except ValueError:
+            messagebox.showerror("Input Error", "Display gamma must be blank or a number between 0.5 and 4.", parent=self.window); return False
+        if self.config.stimulus_source == STIMULUS_SOURCE_GENERATED:
+            try:
+                self.config.checker_colors = self.checker_colors_var.get()
+                self.config.checker_layout = self.checker_layout_var.get()
+                self.config.check_size = float(self.check_size_var.get())
+                self.config.check_units = self.check_units_var.get()
+                self.config.viewing_distance_cm = float(self.viewing_distance_var.get())
+                self.config.screen_width_cm = float(self.screen_width_cm_var.get())
+                if self.config.check_size <= 0 or self.config.viewing_distance_cm <= 0 or self.config.screen_width_cm <= 0:
+                    raise ValueError("Check size, viewing distance and screen width must be positive.")
+            except (tk.TclError, ValueError) as e:
+                messagebox.showerror("Input Error", f"Invalid checkerboard parameters:\n{e}", parent=self.window); return False
+        else:
+            if not (self.config.image1_path and os.path.exists(self.config.image1_path)):
+                messagebox.showerror("Input Error", "Valid Image 1 required.", parent=self.window); return False
+            if not (self.config.image2_path and os.path.exists(self.config.image2_path)):
+                messagebox.showerror("Input Error", "Valid Image 2 required.", parent=self.window); return False
+            if self.config.image1_path == self.config.image2_path and \
+               not messagebox.askyesno("Warning", "Images are same (no flicker). Continue?", parent=self.window): return False
         if not self.config.log_dir_participant:
             messagebox.showerror("Input Error", "Participant Log Directory required.", parent=self.window); return False
         try: os.makedirs(self.config.log_dir_participant, exist_ok=True) 
@@ -1037,50 +1242,29 @@ class ExperimentRunnerWindow:
         return True
 
     def load_trials_from_csv(self):
-        trials = []
-        try:
-            with open(self.config.master_csv_path, 'r', newline='') as f:
-                reader = csv.DictReader(f)
-                reader.fieldnames = [field.strip() for field in reader.fieldnames or []]
-                expected = ['trial_number', 'brightness_factor', 'stimulus_duration', 'fixation_duration', 'checkerboard_hz']
-                missing = [col for col in expected if col not in reader.fieldnames]
-                if missing:
-                    messagebox.showerror("CSV Error", f"CSV missing: {', '.join(missing)}", parent=self.window); return False
-                for i, row in enumerate(reader):
-                    try:
-                        block_num_csv = row.get('block_number')
-                        trial_in_block_csv = row.get('trial_in_block')
-
-                        if block_num_csv is not None and trial_in_block_csv is not None:
-                            block_num = int(block_num_csv)
-                            trial_in_block = int(trial_in_block_csv)
-                        else: 
-                            trial_idx_overall = int(row['trial_number']) -1 
-                            if trial_idx_overall < RAMP_UP_TRIALS_COUNT:
-                                block_num = 0 
-                                trial_in_block = trial_idx_overall + 1
-                            else:
-                                randomized_trial_idx = trial_idx_overall - RAMP_UP_TRIALS_COUNT
-                                block_num = (randomized_trial_idx // TRIALS_PER_BLOCK) + 1
-                                trial_in_block = (randomized_trial_idx % TRIALS_PER_BLOCK) + 1
-                        
-                        trials.append({
-                            'trial_number': int(row['trial_number']),
-                            'block_number': block_num,
-                            'trial_in_block': trial_in_block,
-                            'brightness_factor': float(row['brightness_factor']),
-                            'stimulus_duration': float(row['stimulus_duration']),
-                            'fixation_duration': float(row['fixation_duration']),
-                            'checkerboard_hz': float(row['checkerboard_hz'])})
-                    except (ValueError, KeyError) as ve:
-                        messagebox.showerror("CSV Data Error", f"Row {i+2}: {ve}\n{row}", parent=self.window); return False
-            if not trials: messagebox.showerror("CSV Error", "No valid trials in CSV.", parent=self.window); return False
-            self.config.trials_data = trials
-            return True
+        try: self.config.trials_data = load_trial_plan(self.config.master_csv_path); return True
+        except ValueError as ve: messagebox.showerror("CSV Error", str(ve), parent=self.window); return False
         except Exception as e: messagebox.showerror("CSV Read Error", f"Error reading {self.config.master_csv_path}:\n{e}", parent=self.window); return False
 
+    def offer_resume(self):
+        """ Asks whether to continue an unfinished session for this participant and master CSV; declining retires it. """
+        n = len(self.config.trials_data)
+        try: state = SessionJournal.find_unfinished(self.config.log_dir_participant, self.config.participant_id,
+                                                    self.config.master_csv_path, n, ExperimentCatalog(self.config.catalog_path))
+        except OSError as e: log(f"Could not check for unfinished sessions: {e}"); return None
+        if not state: return None
+        done = len(state['completed'])
+        if messagebox.askyesno("Resume Session",
+                               f"Participant {self.config.participant_id} has an unfinished session with this master CSV "
+                               f"(started {state['header']['time'].replace('T', ' ')}, {done} of {n} trials completed).\n\n"
+                               f"Resume at trial {done + 1}?\n\nChoose 'No' to start over from trial 1.", parent=self.window):
+            return state
+        SessionJournal.abandon(state)
+        return None
+
     def start_experiment(self):
         if not self.validate_inputs() or not self.load_trials_from_csv(): return
+        self.config.resume_state = self.offer_resume()
         self.window.withdraw()
         execute_experiment_run(self.config)
         self.window.deiconify()
@@ -1093,7 +1277,132 @@ class RunConfig:
         self.image2_path = ""
         self.participant_id = ""
         self.log_dir_participant = DEFAULT_LOG_DIR_PARTICIPANT 
-        self.trials_data = []
+        self.trials_data = None # TrialPlan compiled from master_csv_path by load_trial_plan()
+        self.frame_miss_policy = FRAME_MISS_POLICY
+        self.journal_fsync = JOURNAL_FSYNC_POLICY
+        self.catalog_path = CATALOG_PATH
+        self.columnar_export = True # also write data_P*_trials.parquet (.npz when pyarrow is not installed)
+        self.resume_state = None # SessionJournal.read() state of an unfinished session to continue
+        self.presentation_mode = PRESENTATION_TIMED
+        self.vsync_strict = False # refuse to run when a requested Hz is not a whole number of frames
+        self.renderer_backend = RENDERER_SURFACE
+        self.use_frame_cache = True
+        self.display_gamma = None # e.g. 2.2: brightness_factor then scales linear luminance rather than RGB values
+        self.use_indexed_color = True # boards with <= 256 colours get the 8-bit palette path (surface renderer only)
+        self.stimulus_source = STIMULUS_SOURCE_IMAGES
+        self.checker_colors = "bw"
+        self.checker_layout = "grid"
+        self.check_size = float(DEFAULT_CHECK_SIZE_PX)
+        self.check_units = "px"
+        self.viewing_distance_cm = DEFAULT_VIEWING_DISTANCE_CM
+        self.screen_width_cm = DEFAULT_SCREEN_WIDTH_CM
+
+    def stimulus_names(self):
+        """ Names logged as Image1_File/Image2_File: the image paths, or a description of the generated pair. """
+        if self.stimulus_source != STIMULUS_SOURCE_GENERATED: return self.image1_path, self.image2_path
+        spec = f"generated_{self.checker_layout}_{self.checker_colors}_{self.check_size:g}{self.check_units}"
+        return f"{spec}_phase1", f"{spec}_phase2"
+
+# --- Trial Plan ---
+class TrialPlanError(ValueError):
+    """ Every problem found in a master CSV, as (line, message) pairs; line is None for file-level problems. """
+    def __init__(self, path, errors):
+        self.path, self.errors = path, errors
+        shown = [f"Row {line}: {msg}" if line else msg for line, msg in errors[:TRIAL_PLAN_ERRORS_SHOWN]]
+        if len(errors) > len(shown): shown.append(f"... and {len(errors) - len(shown)} more")
+        super().__init__(f"{len(errors)} problem(s) in {os.path.basename(path)}:\n" + "\n".join(shown))
+
+class Trial:
+    """ One compiled trial with its frame cycle (custom or default) and per-frame holds already resolved. """
+    __slots__ = ('index',) + TRIAL_PLAN_DTYPE.names + ('frame_sequence', 'cycle', 'holds')
+
+    def __init__(self, index, values, frame_sequence=None, resolve_holds=None):
+        self.index = index
+        for name, value in zip(TRIAL_PLAN_DTYPE.names, values): setattr(self, name, value)
+        self.frame_sequence = frame_sequence
+        self.cycle = frame_sequence or (DEFAULT_FRAME_SEQUENCE if self.checkerboard_hz > 0 else STATIC_FRAME_SEQUENCE)
+        self.holds = (resolve_holds or resolve_frame_holds)(self.cycle, self.checkerboard_hz, self.stimulus_duration)
+
+class TrialPlan:
+    """ A master CSV compiled once: `array` (TRIAL_PLAN_DTYPE) for whole-column work, Trial records for the run loop. """
+    def __init__(self, array, frame_sequences, source="", cached=False):
+        self.array, self.source, self.cached = array, source, cached
+        resolve = functools.lru_cache(maxsize=None)(resolve_frame_holds) # trials share a few (cycle, Hz, duration) combinations
+        self.trials = [Trial(i, values, frame_sequences.get(i), resolve) for i, values in enumerate(array.tolist())]
+
+    def __len__(self): return len(self.trials)
+    def __iter__(self): return iter(self.trials)
+    def __getitem__(self, i): return self.trials[i]
+
+def compile_trial_plan(path):
+    """ Parses and checks a master CSV in one pass. Raises TrialPlanError listing every bad row, not just the first. """
+    csv_dir = os.path.dirname(os.path.abspath(path))
+    rows, sequences, errors = [], {}, []
+    with open(path, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [field.strip() for field in reader.fieldnames or []]
+        missing = [col for col in TRIAL_PLAN_REQUIRED if col not in reader.fieldnames]
+        if missing: raise TrialPlanError(path, [(None, f"CSV missing: {', '.join(missing)}")])
+        has_blocks = 'block_number' in reader.fieldnames and 'trial_in_block' in reader.fieldnames
+        fields = TRIAL_PLAN_REQUIRED + (('block_number', 'trial_in_block') if has_blocks else ())
+        for line, row in enumerate(reader, 2):
+            values, problems = {}, []
+            for name in fields:
+                cell = (row.get(name) or '').strip()
+                if not cell: problems.append(f"{name} is empty"); continue
+                try: value = int(cell) if TRIAL_PLAN_DTYPE[name].kind == 'i' else float(cell)
+                except ValueError: problems.append(f"{name} '{cell}' is not a {'whole ' if TRIAL_PLAN_DTYPE[name].kind == 'i' else ''}number"); continue
+                check, need = TRIAL_PLAN_LIMITS.get(name, (None, None))
+                if not math.isfinite(value): problems.append(f"{name} {cell} is not finite")
+                elif check and not check(value): problems.append(f"{name} {cell} {need}")
+                values[name] = value
+            if not has_blocks and 'trial_number' in values:
+                idx = values['trial_number'] - 1 # older CSVs: ramp-up is block 0, then TRIALS_PER_BLOCK per block
+                if idx < RAMP_UP_TRIALS_COUNT: values['block_number'], values['trial_in_block'] = 0, idx + 1
+                else:
+                    block, pos = divmod(idx - RAMP_UP_TRIALS_COUNT, TRIALS_PER_BLOCK)
+                    values['block_number'], values['trial_in_block'] = block + 1, pos + 1
+            try:
+                seq = parse_frame_sequence(row.get('frame_sequence'), csv_dir)
+                if seq and 'checkerboard_hz' in values and 'stimulus_duration' in values:
+                    resolve_frame_holds(seq, values['checkerboard_hz'], values['stimulus_duration'])
+            except ValueError as e: problems.append(f"frame_sequence: {e}"); seq = None
+            if problems: errors += [(line, msg) for msg in problems]; continue
+            if seq: sequences[len(rows)] = seq
+            rows.append(tuple(values[name] for name in TRIAL_PLAN_DTYPE.names))
+    if errors: raise TrialPlanError(path, errors)
+    if not rows: raise TrialPlanError(path, [(None, "No valid trials in CSV.")])
+    return TrialPlan(np.array(rows, dtype=TRIAL_PLAN_DTYPE), sequences, path)
+
+def trial_plan_cache_key(path):
+    """ CSV content hash plus everything else the compiled plan depends on (block derivation, frame path resolution). """
+    return (f"v{TRIAL_PLAN_VERSION}:{file_sha1(path)}:{RAMP_UP_TRIALS_COUNT}:{TRIALS_PER_BLOCK}:"
+            f"{os.path.dirname(os.path.abspath(path))}")
+
+def load_trial_plan(path, use_cache=True):
+    """ Compiled plan for a master CSV, from the cache next to it when the CSV is unchanged; otherwise compiles it and
+    refreshes the cache (a read-only folder just means no cache). """
+    cache_path = os.path.splitext(path)[0] + TRIAL_PLAN_SUFFIX
+    key = trial_plan_cache_key(path)
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle=False) as z:
+                if str(z['key']) == key:
+                    sequences = {int(i): tuple((src, hold) for src, hold in seq) for i, seq in json.loads(str(z['frames'])).items()}
+                    # an image named in a frame_sequence that has since gone away means recompiling (and reporting it)
+                    if all(os.path.isfile(src) for seq in sequences.values() for src, _ in seq if src not in ('1', '2', FRAME_BLANK)):
+                        return TrialPlan(z['plan'], sequences, path, cached=True)
+        except Exception as e: log(f"Ignoring unreadable trial plan cache {cache_path}: {e}")
+    plan = compile_trial_plan(path)
+    if use_cache:
+        tmp = cache_path + ".tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, plan=plan.array, key=np.array(key),
+                         frames=np.array(json.dumps({i: t.frame_sequence for i, t in enumerate(plan) if t.frame_sequence})))
+            os.replace(tmp, cache_path)
+        except OSError as e: log(f"Could not cache trial plan {cache_path}: {e}")
+    return plan
 
 # --- Rating Scale Class (Pygame UI) ---
 class RatingScale:
@@ -1103,14 +1412,7 @@ class RatingScale:
         self.pygame_scale_factor = max(0.5, min(3.0, screen.get_height() / PYGAME_REFERENCE_SCREEN_HEIGHT))
         
         fs_n, fs_l, fs_b = int(36*self.pygame_scale_factor), int(48*self.pygame_scale_factor), int(30*self.pygame_scale_factor)
-        try:
-            self.font = pygame.font.Font(None, fs_n)
-            self.val_font = pygame.font.Font(None, fs_l)
-            self.button_font = pygame.font.Font(None, fs_b)
-        except: 
-            self.font = pygame.font.SysFont("arial", fs_n)
-            self.val_font = pygame.font.SysFont("arial", fs_l)
-            self.button_font = pygame.font.SysFont("arial", fs_b)
+        self.font, self.val_font, self.button_font = TEXT_CACHE.font(fs_n), TEXT_CACHE.font(fs_l), TEXT_CACHE.font(fs_b)
         
         if self.scale_type == "unpleasantness":
             self.title = "Please rate the unpleasantness of the image you just viewed."
@@ -1133,6 +1435,7 @@ class RatingScale:
         self.confirm_button_y = self.scale_y + int(120 * self.pygame_scale_factor) 
         self.confirm_button_rect = pygame.Rect(self.confirm_button_x, self.confirm_button_y, self.confirm_button_width, self.confirm_button_height)
         self.confirm_button_text = "Confirm"; self.button_color = GREEN; self.button_hover_color = DARK_GREEN
+        self.background = None; self.dynamic_rects = []
 
     def get_scale_labels(self):
         if self.scale_type == "unpleasantness":
@@ -1142,29 +1445,34 @@ class RatingScale:
         else: 
             return "Low", "High"
 
-    def draw(self):
-        ts = self.font.render(self.title, True, WHITE)
-        self.screen.blit(ts, ts.get_rect(centerx=self.screen.get_width()//2, bottom=self.scale_y - int(60*self.pygame_scale_factor)))
-        pygame.draw.rect(self.screen, GRAY_COLOR, (self.scale_x-1, self.scale_y-1, self.scale_width+2, self.scale_height+2))
-        pygame.draw.rect(self.screen, WHITE, (self.scale_x, self.scale_y, self.scale_width, self.scale_height))
+    def render_background(self):
+        """ Renders everything that never changes (title, bar, ticks, numbers, end labels) once. """
+        bg = self.screen.copy(); bg.fill(BLACK)
+        ts = TEXT_CACHE.render(self.font, self.title, WHITE)
+        bg.blit(ts, ts.get_rect(centerx=self.screen.get_width()//2, bottom=self.scale_y - int(60*self.pygame_scale_factor)))
+        pygame.draw.rect(bg, GRAY_COLOR, (self.scale_x-1, self.scale_y-1, self.scale_width+2, self.scale_height+2))
+        pygame.draw.rect(bg, WHITE, (self.scale_x, self.scale_y, self.scale_width, self.scale_height))
         
         num_ticks = 11; tick_h = int(10*self.pygame_scale_factor); num_off = int(15*self.pygame_scale_factor); tick_w = max(1,int(1*self.pygame_scale_factor))
         for i in range(num_ticks):
             val = self.min_val + i * (self.max_val - self.min_val) / (num_ticks-1)
             tx = self.scale_x + (val - self.min_val) / (self.max_val - self.min_val) * self.scale_width
-            pygame.draw.line(self.screen, WHITE, (tx, self.scale_y+self.scale_height), (tx, self.scale_y+self.scale_height+tick_h), tick_w)
+            pygame.draw.line(bg, WHITE, (tx, self.scale_y+self.scale_height), (tx, self.scale_y+self.scale_height+tick_h), tick_w)
             if i % 2 == 0:
-                tns = self.font.render(str(int(val)), True, WHITE)
-                self.screen.blit(tns, tns.get_rect(centerx=tx, top=self.scale_y+self.scale_height+num_off))
+                tns = TEXT_CACHE.render(self.font, str(int(val)), WHITE)
+                bg.blit(tns, tns.get_rect(centerx=tx, top=self.scale_y+self.scale_height+num_off))
         
         ll, rl = self.get_scale_labels()
         loff = self.scale_y + self.scale_height + num_off + self.font.get_height() + int(10*self.pygame_scale_factor)
         lspace = int(self.font.get_linesize() * 0.9) 
         for i, line in enumerate(ll.split('\n')):
-            ls = self.font.render(line, True, WHITE); self.screen.blit(ls, ls.get_rect(centerx=self.scale_x, top=loff+i*lspace))
+            ls = TEXT_CACHE.render(self.font, line, WHITE); bg.blit(ls, ls.get_rect(centerx=self.scale_x, top=loff+i*lspace))
         for i, line in enumerate(rl.split('\n')):
-            ls = self.font.render(line, True, WHITE); self.screen.blit(ls, ls.get_rect(centerx=self.scale_x+self.scale_width, top=loff+i*lspace))
-            
+            ls = TEXT_CACHE.render(self.font, line, WHITE); bg.blit(ls, ls.get_rect(centerx=self.scale_x+self.scale_width, top=loff+i*lspace))
+        return bg
+
+    def draw_dynamic(self):
+        """ Draws the slider, its value label and the confirm button; returns the rects they cover. """
         slider_x = self.scale_x + (self.value - self.min_val) / (self.max_val - self.min_val) * self.scale_width
         slider_x = max(self.scale_x, min(self.scale_x + self.scale_width, slider_x))
         self.slider_rect.size = (self.slider_width, self.slider_height)
@@ -1173,18 +1481,37 @@ class RatingScale:
         pygame.draw.rect(self.screen, (200,200,200), self.slider_rect, border_radius=sbr)
         pygame.draw.rect(self.screen, WHITE, self.slider_rect, width=sbw, border_radius=sbr)
         
-        vt = self.val_font.render(str(int(self.value)), True, WHITE)
-        vr = vt.get_rect(centerx=slider_x, bottom=self.slider_rect.top - int(10*self.pygame_scale_factor))
-        self.screen.blit(vt, vr.clamp(self.screen.get_rect()))
+        vt = TEXT_CACHE.render(self.val_font, str(int(self.value)), WHITE)
+        vr = vt.get_rect(centerx=slider_x, bottom=self.slider_rect.top - int(10*self.pygame_scale_factor)).clamp(self.screen.get_rect())
+        self.screen.blit(vt, vr)
         
-        btn_col = self.button_hover_color if self.confirm_button_rect.collidepoint(pygame.mouse.get_pos()) else self.button_color
+        btn_col = self.button_hover_color if self.is_hovered() else self.button_color
         bbr = max(2, int(5*self.pygame_scale_factor))
         pygame.draw.rect(self.screen, btn_col, self.confirm_button_rect, border_radius=bbr)
-        cts = self.button_font.render(self.confirm_button_text, True, WHITE)
+        cts = TEXT_CACHE.render(self.button_font, self.confirm_button_text, WHITE)
         self.screen.blit(cts, cts.get_rect(center=self.confirm_button_rect.center))
+        return [self.slider_rect.copy(), vr, self.confirm_button_rect.copy()]
+
+    def is_hovered(self): return self.confirm_button_rect.collidepoint(pygame.mouse.get_pos())
+
+    def state(self):
+        """ Everything the dynamic layer depends on; the screen only needs redrawing when this changes. """
+        return int(self.value), self.is_hovered()
+
+    def draw(self):
+        if self.background is None: self.background = self.render_background()
+        self.screen.blit(self.background, (0, 0))
+        self.dynamic_rects = self.draw_dynamic()
+
+    def redraw(self):
+        """ Restores the background under the previous dynamic layer, redraws it and returns the dirty rects. """
+        old = self.dynamic_rects
+        for r in old: self.screen.blit(self.background, r, r)
+        self.dynamic_rects = self.draw_dynamic()
+        return old + self.dynamic_rects
 
     def handle_event(self, event):
-        mp = pygame.mouse.get_pos()
+        mp = getattr(event, 'pos', None) or pygame.mouse.get_pos()
         ir = pygame.Rect(self.scale_x - self.slider_width, self.scale_y - self.slider_height,
                          self.scale_width + 2*self.slider_width, self.scale_height + 2*self.slider_height)
         
@@ -1204,9 +1531,160 @@ class RatingScale:
             update_value_from_mouse()
         return None
 
+class RatingTrajectory:
+    """ Preallocated record of one rating screen's mouse input: (ms since first flip, x, value, event) per event.
+    One instance per scale is reused every trial; record() only stores scalars so the input loop never allocates. """
+    EVENT_CODES = {pygame.MOUSEBUTTONDOWN: 1, pygame.MOUSEBUTTONUP: 2, pygame.MOUSEMOTION: 3}
+    CONFIRM = 4
+
+    def __init__(self, scale_type, capacity=RATING_TRAJECTORY_CAPACITY):
+        self.scale_code = RATING_SCALE_CODES.get(scale_type, 0)
+        self.data = np.zeros(capacity, dtype=RATING_RECORD_DTYPE)
+        self.begin(0.0)
+
+    def begin(self, onset_t):
+        self.onset_t, self.count, self.overflow = onset_t, 0, 0
+        self.first_touch_ms, self.confirm_ms = None, None
+
+    def record(self, t, x, value, code):
+        t_ms = (t - self.onset_t) * 1000.0
+        if code in (1, self.CONFIRM) and self.first_touch_ms is None: self.first_touch_ms = t_ms # first button press
+        if code == self.CONFIRM: self.confirm_ms = t_ms
+        if self.count < len(self.data):
+            self.data[self.count] = (0, self.scale_code, code, value, x, t_ms); self.count += 1
+        else: self.overflow += 1
+
+    def records(self, trial_number):
+        rows = self.data[:self.count].copy()
+        rows['trial'] = trial_number
+        return rows
+
+def load_rating_trajectories(path):
+    """ Reads a *_ratings.bin sidecar into a structured array of RATING_RECORD_DTYPE. """
+    with open(path, 'rb') as f: raw = f.read()
+    if not raw.startswith(RATING_TRAJECTORY_MAGIC): raise ValueError(f"Not a rating trajectory file: {path}")
+    n = (len(raw) - len(RATING_TRAJECTORY_MAGIC)) // RATING_RECORD_DTYPE.itemsize
+    return np.frombuffer(raw, dtype=RATING_RECORD_DTYPE, count=n, offset=len(RATING_TRAJECTORY_MAGIC))
+
+def session_columns_from_rows(rows):
+    """ Converts data_P*.csv trial rows (lists of cells, as written) into typed arrays keyed by column name. """
+    cols = {}
+    for i, (name, kind) in enumerate(SESSION_COLUMNS):
+        cells = [str(r[i]) if i < len(r) else '' for r in rows]
+        if kind == 'f8': cols[name] = np.array([float(c) if c else np.nan for c in cells], dtype=np.float64)
+        elif kind == 'i4': cols[name] = np.array([int(float(c)) if c else -1 for c in cells], dtype=np.int32)
+        else: cols[name] = np.array(cells, dtype=str)
+    return cols
+
+def write_columns(path_prefix, cols, metadata, parquet=True):
+    """ Writes equal-length typed arrays as Parquet (if parquet and pyarrow is installed) or .npz, with metadata
+    stored as JSON. Returns the path written. """
+    pa = None
+    if parquet:
+        try: import pyarrow as pa, pyarrow.parquet as pq
+        except ImportError: pa = None
+    if pa is not None:
+        table = pa.table(cols).replace_schema_metadata({SESSION_METADATA_KEY: json.dumps(metadata).encode('utf-8')})
+        pq.write_table(table, path_prefix + ".parquet"); return path_prefix + ".parquet"
+    np.savez(path_prefix + ".npz", **cols, **{SESSION_METADATA_KEY.decode(): np.array(json.dumps(metadata))})
+    return path_prefix + ".npz"
+
+def read_columns(path):
+    """ Reads a file written by write_columns(); returns (columns, metadata). """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        metadata = json.loads((table.schema.metadata or {}).get(SESSION_METADATA_KEY, b"{}"))
+        cols = {name: table.column(name).to_numpy() for name in table.column_names}
+        return {name: (v.astype(str) if v.dtype == object else v) for name, v in cols.items()}, metadata
+    with np.load(path, allow_pickle=False) as z:
+        metadata = json.loads(str(z[SESSION_METADATA_KEY.decode()]))
+        return {name: z[name] for name in z.files if name != SESSION_METADATA_KEY.decode()}, metadata
+
+def save_session_columns(path_prefix, rows, metadata):
+    """ Writes a session's trials as Parquet (if pyarrow is installed) or .npz, with the CSV preamble as metadata.
+    Returns the path written. """
+    return write_columns(path_prefix, session_columns_from_rows(rows), metadata)
+
+def load_session_columns(path):
+    """ Reads a *_trials.parquet / *_trials.npz export. Returns (columns, metadata): columns maps every SESSION_COLUMNS
+    name to a NumPy array, plus Participant_ID and Experiment_ID broadcast per trial, so arrays from many sessions
+    can be joined with np.concatenate. """
+    cols, metadata = read_columns(path)
+    n = len(cols['Trial_Number_Overall'])
+    for key in ('Participant_ID', 'Experiment_ID'):
+        if key not in cols: cols[key] = np.array([metadata.get(key, '')] * n, dtype=str) # cohort tables already have them
+    return cols, metadata
+
+# --- Background Writer ---
+class BackgroundWriter:
+    """ Runs file writes and console output on one daemon thread, in submission order, so a slow disk or terminal
+    never stalls the presentation loop. The queue is bounded: when it is full, submit() blocks, and each block is
+    counted as backpressure. Until start() (or after close()) submit() runs the task inline. """
+    active = None # the running session writer; log() routes through it
+
+    def __init__(self, max_queue=WRITER_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.submitted, self.blocked, self.errors, self.max_depth = 0, 0, 0, 0
+        self.worst_enqueue_s, self.blocked_s = 0.0, 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._drain, name="mvast3-writer", daemon=True)
+        self.thread.start(); BackgroundWriter.active = self
+        return self
+
+    def on_writer_thread(self): return threading.current_thread() is self.thread
+
+    def submit(self, fn, *args):
+        if self.thread is None or self.on_writer_thread(): self._run(fn, args); return
+        t0 = time.perf_counter()
+        try: self.queue.put_nowait((fn, args))
+        except queue.Full:
+            self.blocked += 1; self.queue.put((fn, args)); self.blocked_s += time.perf_counter() - t0
+        self.worst_enqueue_s = max(self.worst_enqueue_s, time.perf_counter() - t0)
+        self.submitted += 1; self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def _run(self, fn, args):
+        try: fn(*args)
+        except Exception as e:
+            self.errors += 1; print(f"Background write failed ({getattr(fn, '__qualname__', fn)}): {type(e).__name__}: {e}")
+
+    def _drain(self):
+        while True:
+            item = self.queue.get()
+            if item is None: return
+            self._run(*item)
+
+    def close(self):
+        """ Waits for every queued task to finish, then stops the thread; later submits run inline. """
+        if self.thread is None: return
+        self.queue.put(None); self.thread.join(); self.thread = None
+        if BackgroundWriter.active is self: BackgroundWriter.active = None
+
+    def stats(self):
+        return {'submitted': self.submitted, 'blocked': self.blocked, 'blocked_ms': self.blocked_s * 1000.0,
+                'worst_enqueue_ms': self.worst_enqueue_s * 1000.0, 'max_queue_depth': self.max_depth, 'errors': self.errors}
+
+    def report(self):
+        st = self.stats()
+        print(f"Background writer: {st['submitted']} tasks, worst enqueue {st['worst_enqueue_ms']:.3f} ms, "
+              f"peak queue {st['max_queue_depth']}/{self.queue.maxsize}, {st['blocked']} blocked "
+              f"({st['blocked_ms']:.1f} ms), {st['errors']} failed.")
+
+INLINE_WRITER = BackgroundWriter() # never started: tasks run on the caller's thread
+
+def log(*parts):
+    """ Diagnostic output. Queued behind the session's pending writes while a BackgroundWriter is active. """
+    writer = BackgroundWriter.active
+    if writer is not None and not writer.on_writer_thread(): writer.submit(print, *parts)
+    else: print(*parts)
+
 # --- Data Handlers ---
 class ParticipantDataHandler:
-    def __init__(self, log_dir_participant, participant_id, master_csv_path, image1_path, image2_path):
+    def __init__(self, log_dir_participant, participant_id, master_csv_path, image1_path, image2_path,
+                 presentation_mode=PRESENTATION_TIMED, refresh_hz=None, renderer_backend=RENDERER_SURFACE, display_gamma=None,
+                 resume_state=None, io=None, columnar_export=True, experiment_id=None, fsync_policy=JOURNAL_FSYNC_POLICY):
         self.log_dir = log_dir_participant 
         self.participant_id = participant_id
         self.master_csv_name = os.path.basename(master_csv_path)
@@ -1216,78 +1694,726 @@ class ParticipantDataHandler:
         os.makedirs(self.log_dir, exist_ok=True) 
         ts = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = os.path.join(self.log_dir, f"data_P{self.participant_id}_{ts}.csv")
+        self.filename, self.sidecar_prefix = filename, os.path.splitext(filename)[0]
+        self.trajectory_file, self.io = None, io or INLINE_WRITER
+        self.rows, self.columnar_export, self.fsync_policy = [], columnar_export, fsync_policy # same policy as the journal
+        self.experiment_id = exp_id_from_master = experiment_id or (self.master_csv_name.split('_master_trials.csv')[0]
+                                                   if '_master_trials.csv' in self.master_csv_name else 'UnknownExpID')
         try:
             self.file = open(filename, 'w', newline='', encoding='utf-8')
             self.writer = csv.writer(self.file)
-            exp_id_from_master = self.master_csv_name.split('_master_trials.csv')[0] if '_master_trials.csv' in self.master_csv_name else 'UnknownExpID'
-            self.writer.writerows([
+            self.preamble = [
                 ['App_Version', APP_VERSION],
                 ['Experiment_ID', exp_id_from_master], ['Participant_ID', self.participant_id],
                 ['Timestamp_Start_Run', datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
                 ['Master_CSV_Used', self.master_csv_name], 
                 ['Image1_File', self.image1_name], 
                 ['Image2_File', self.image2_name], 
-                [],
-                ['Trial_Number_Overall', 'Block_Number', 'Trial_In_Block', 'Brightness_Factor',
-                 'Stimulus_Duration_s', 'Fixation_Duration_s', 'Checkerboard_Hz',
-                 'Discomfort_Rating_0_100', 'Brightness_Rating_0_100', 'Response_Timestamp']
-            ])
-            print(f"Logging data to: {filename}")
+                ['Presentation_Mode', presentation_mode],
+                ['Renderer_Backend', renderer_backend],
+                ['Display_Gamma', f"{display_gamma:g}" if display_gamma else ''],
+                ['Refresh_Rate_Hz', f"{refresh_hz:.3f}" if refresh_hz else ''],
+                ['Session_Segment', resume_state['segments'] + 1 if resume_state else 1],
+                ['Resumed_From', f"{resume_state['data_files'][-1]} after trial {resume_state['completed'][-1]['trial_number']}"
+                                 if resume_state else '']]
+            self.writer.writerows(self.preamble + [[], [name for name, _ in SESSION_COLUMNS]])
+            log(f"Logging data to: {filename}")
         except IOError as e: messagebox.showerror("File Error", f"Cannot open log {filename}:\n{e}"); raise
 
-    def save_trial_response(self, trial_info, discomfort, brightness_rating):
-        if not self.writer: print("DataHandler not init."); return
+    def save_trial_response(self, trial_info, discomfort, brightness_rating, frame_plan=None, telemetry=None,
+                            trajectories=None):
+        if not self.writer: log("DataHandler not init."); return
         ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        plan_cols = ([f"{frame_plan['achieved_hz']:.4f}", frame_plan['stim_frames'],
+                      FRAME_SEQUENCE_SEPARATOR.join(map(str, frame_plan['hold_frames']))] if frame_plan else ['', '', ''])
+        plan_cols += self.save_flip_telemetry(trial_info, telemetry) if telemetry else ['', '', '']
+        plan_cols.append(format_frame_sequence(trial_info.frame_sequence))
+        plan_cols += self.save_rating_trajectories(trial_info, trajectories) if trajectories else ['', '', '', '']
+        self.io.submit(self._write_row, [
+            trial_info.trial_number, trial_info.block_number, trial_info.trial_in_block,
+            f"{trial_info.brightness_factor:.2f}", trial_info.stimulus_duration,
+            trial_info.fixation_duration, trial_info.checkerboard_hz,
+            int(discomfort), int(brightness_rating), ts] + plan_cols)
+
+    def _write_row(self, row):
+        self.rows.append(row)
+        try:
+            self.writer.writerow(row); self.file.flush()
+            if self.fsync_policy == "trial": os.fsync(self.file.fileno())
+        except Exception as e: log(f"Error writing trial to CSV: {e}")
+
+    def save_flip_telemetry(self, trial_info, telemetry):
+        """ Queues the trial's flip log as an .npz sidecar and returns its summary columns for the CSV row. """
+        summ = telemetry.summary()
+        path = f"{self.sidecar_prefix}_trial{trial_info.trial_number:03d}_flips.npz"
+        self.io.submit(self._write_flips, path, telemetry.snapshot(),
+                       {'trial_number': trial_info.trial_number, 'checkerboard_hz': trial_info.checkerboard_hz})
+        return [f"{summ['mean_achieved_hz']:.4f}", f"{summ['max_interval_error_ms']:.3f}", summ['dropped_flips']]
+
+    def _write_flips(self, path, arrays, meta):
+        try: np.savez_compressed(path, **arrays, **meta)
+        except Exception as e: log(f"Error writing flip telemetry {path}: {e}")
+
+    def save_rating_trajectories(self, trial_info, trajectories):
+        """ Queues the trial's rating input events for the session's binary sidecar and returns the latency columns
+        (first touch and confirm, ms from each rating screen's first flip). """
+        for traj in trajectories:
+            if traj.overflow: log(f"Trial {trial_info.trial_number}: {traj.overflow} rating events not stored.")
+        self.io.submit(self._write_trajectories, [traj.records(trial_info.trial_number) for traj in trajectories])
+        fmt = lambda ms: f"{ms:.1f}" if ms is not None else ''
+        return [fmt(v) for traj in trajectories for v in (traj.first_touch_ms, traj.confirm_ms)]
+
+    def _write_trajectories(self, records):
+        path = f"{self.sidecar_prefix}_ratings.bin"
         try:
-            self.writer.writerow([
-                trial_info['trial_number'], trial_info['block_number'], trial_info['trial_in_block'],
-                f"{trial_info['brightness_factor']:.2f}", trial_info['stimulus_duration'],
-                trial_info['fixation_duration'], trial_info['checkerboard_hz'],
-                int(discomfort), int(brightness_rating), ts])
-            self.file.flush()
-        except Exception as e: print(f"Error writing trial to CSV: {e}")
+            if self.trajectory_file is None:
+                self.trajectory_file = open(path, 'wb'); self.trajectory_file.write(RATING_TRAJECTORY_MAGIC)
+            for rows in records: rows.tofile(self.trajectory_file)
+            self.trajectory_file.flush()
+        except Exception as e: log(f"Error writing rating trajectories {path}: {e}")
 
     def close(self):
+        """ Queued behind any pending trial writes. """
+        self.io.submit(self._close, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+    def _close(self, end_ts):
+        if self.trajectory_file:
+            try: self.trajectory_file.close()
+            except Exception as e: log(f"Error closing rating trajectories: {e}")
+            self.trajectory_file = None
         if self.file:
             try:
-                if self.writer: self.writer.writerow(['Timestamp_End_Run', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
+                if self.writer: self.writer.writerow(['Timestamp_End_Run', end_ts])
+                self.file.flush()
+                if self.fsync_policy != "off": os.fsync(self.file.fileno())
                 self.file.close(); self.file = None; self.writer = None
-                print("Participant data log closed.")
-            except Exception as e: print(f"Error closing data log: {e}")
+                log("Participant data log closed.")
+            except Exception as e: log(f"Error closing data log: {e}")
+        if self.columnar_export and self.rows:
+            meta = {k: str(v) for k, v in self.preamble}; meta['Timestamp_End_Run'] = end_ts
+            try: log(f"Columnar session data saved to: {save_session_columns(self.sidecar_prefix + '_trials', self.rows, meta)}")
+            except Exception as e: log(f"Error writing columnar session data: {e}")
+
+class RunningStats:
+    """ Count, mean, variance (Welford), min and max of a stream in constant memory. """
+    __slots__ = ('n', 'mean', 'm2', 'min', 'max')
+    def __init__(self): self.n, self.mean, self.m2, self.min, self.max = 0, 0.0, 0.0, math.inf, -math.inf
+
+    def add(self, x):
+        self.n += 1
+        d = x - self.mean; self.mean += d / self.n; self.m2 += d * (x - self.mean)
+        self.min, self.max = min(self.min, x), max(self.max, x)
+
+    @property
+    def sd(self): return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else None
+
+class RunningSlope:
+    """ Least-squares line of y on x, updated one point at a time from running means and co-moments. """
+    __slots__ = ('n', 'mean_x', 'mean_y', 'cxx', 'cxy', 'cyy')
+    def __init__(self): self.n, self.mean_x, self.mean_y, self.cxx, self.cxy, self.cyy = 0, 0.0, 0.0, 0.0, 0.0, 0.0
+
+    def add(self, x, y):
+        self.n += 1
+        dx = x - self.mean_x; self.mean_x += dx / self.n
+        dy = y - self.mean_y; self.mean_y += dy / self.n
+        self.cxx += dx * (x - self.mean_x); self.cxy += dx * (y - self.mean_y); self.cyy += dy * (y - self.mean_y)
+
+    def fit(self):
+        """ (slope, intercept, r), or None until x has varied. """
+        if self.n < 2 or self.cxx <= 0: return None
+        slope = self.cxy / self.cxx
+        r = self.cxy / math.sqrt(self.cxx * self.cyy) if self.cyy > 0 else 0.0
+        return slope, self.mean_y - slope * self.mean_x, r
 
 class ParticipantScoreHandler:
-    def __init__(self, log_dir_participant, participant_id):
+    SCALES = ("Discomfort", "Brightness")
+
+    def __init__(self, log_dir_participant, participant_id, io=None):
         self.total_discomfort, self.total_brightness, self.num_ratings = 0.0, 0.0, 0
         self.log_dir, self.participant_id = log_dir_participant, participant_id 
-        
-    def add_ratings(self, discomfort, brightness_rating):
-        try: self.total_discomfort += float(discomfort); self.total_brightness += float(brightness_rating); self.num_ratings += 1
-        except (ValueError, TypeError) as e: print(f"Skipped invalid rating (D:{discomfort}, B:{brightness_rating}). Err: {e}")
+        self.io = io or INLINE_WRITER
+        # Per rating scale: overall, per brightness level and per block statistics, and the rating-vs-brightness slope
+        self.stats = {scale: {'all': RunningStats(), 'level': {}, 'block': {}, 'slope': RunningSlope()} for scale in self.SCALES}
+        
+    def add_ratings(self, discomfort, brightness_rating, trial_info=None):
+        try: d, b = float(discomfort), float(brightness_rating)
+        except (ValueError, TypeError) as e: log(f"Skipped invalid rating (D:{discomfort}, B:{brightness_rating}). Err: {e}"); return
+        self.total_discomfort += d; self.total_brightness += b; self.num_ratings += 1
+        for scale, value in zip(self.SCALES, (d, b)):
+            st = self.stats[scale]; st['all'].add(value)
+            if trial_info is None: continue
+            level = round(trial_info.brightness_factor, 2)
+            st['level'].setdefault(level, RunningStats()).add(value)
+            st['block'].setdefault(trial_info.block_number, RunningStats()).add(value)
+            st['slope'].add(level, value)
+
+    def extended_summary_rows(self):
+        fmt = lambda v: f"{v:.2f}" if v is not None else ''
+        rows = [['Scale', 'Grouping', 'Group', 'N', 'Mean', 'SD', 'Min', 'Max']]
+        for scale, st in self.stats.items():
+            groups = [('All', '', st['all'])] + [('Brightness_Level', f"{k:.2f}", v) for k, v in sorted(st['level'].items())]
+            groups += [('Block', str(k), v) for k, v in sorted(st['block'].items())]
+            rows += [[scale, kind, key, r.n, fmt(r.mean), fmt(r.sd), fmt(r.min), fmt(r.max)] for kind, key, r in groups if r.n]
+        rows += [[], ['Scale', 'Slope_Per_Brightness_Factor', 'Intercept', 'R', 'N']]
+        for scale, st in self.stats.items():
+            fit = st['slope'].fit()
+            rows.append([scale] + ([f"{fit[0]:.3f}", f"{fit[1]:.3f}", f"{fit[2]:.4f}"] if fit else ['', '', '']) + [st['slope'].n])
+        return rows
     
     def get_average_scores(self):
         return (self.total_discomfort / self.num_ratings, self.total_brightness / self.num_ratings) if self.num_ratings > 0 else (0.0, 0.0)
     
     def save_final_scores(self):
-        if self.num_ratings == 0: print("No ratings, skipping score save."); return
+        if self.num_ratings == 0: log("No ratings, skipping score save."); return
         avg_d, avg_b = self.get_average_scores()
         ts = datetime.now().strftime('%Y%m%d_%H%M%S')
         fn = os.path.join(self.log_dir, f"summary_P{self.participant_id}_avg_scores_{ts}.csv") 
+        self.io.submit(self._write_scores, fn, [
+            ['Participant_ID', self.participant_id], ['Timestamp_Summary', datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
+            ['Number_Of_Rated_Trials', self.num_ratings], [], ['Metric', 'Average_Score_0_100'],
+            ['Average_Discomfort', f"{avg_d:.2f}"], ['Average_Brightness', f"{avg_b:.2f}"], []] + self.extended_summary_rows())
+
+    def _write_scores(self, fn, rows):
+        try:
+            with open(fn, 'w', newline='', encoding='utf-8') as f: csv.writer(f).writerows(rows)
+            log(f"Average scores saved to: {fn}")
+        except Exception as e: log(f"Error saving summary scores {fn}: {e}")
+
+class SessionJournal:
+    """ Append-only JSON-lines record of a session: a header, one line per completed trial (with its ratings),
+    resume markers and a closing status. A crash can only tear the last line, so every trial before it survives and
+    the session can be resumed at the next trial. Records are written after the ratings, never around a stimulus. """
+    def __init__(self, path, fsync_policy=JOURNAL_FSYNC_POLICY, io=None):
+        if fsync_policy not in JOURNAL_FSYNC_POLICIES: raise ValueError(f"Unknown journal fsync policy: {fsync_policy}")
+        self.path, self.fsync_policy, self.io, self.closed = path, fsync_policy, io or INLINE_WRITER, False
+        torn = os.path.exists(path) and os.path.getsize(path) > 0 and SessionJournal._last_byte(path) != b"\n"
+        self.file = open(path, 'a', encoding='utf-8')
+        if torn: self.file.write("\n") # terminate a line cut off by a crash so new records parse
+
+    @staticmethod
+    def _last_byte(path):
+        with open(path, 'rb') as f: f.seek(-1, os.SEEK_END); return f.read(1)
+
+    @staticmethod
+    def master_digest(master_csv_path): return file_sha1(master_csv_path)
+
+    @classmethod
+    def start(cls, log_dir, participant_id, master_csv_path, num_trials, data_file, fsync_policy=JOURNAL_FSYNC_POLICY, io=None):
+        ts = datetime.now().strftime('%Y%m%d_%H%M%S')
+        journal = cls(os.path.join(log_dir, f"journal_P{participant_id}_{ts}.jsonl"), fsync_policy, io)
+        journal.append({'type': 'session', 'participant_id': participant_id, 'master_csv': os.path.abspath(master_csv_path),
+                        'master_sha1': cls.master_digest(master_csv_path), 'trials': num_trials,
+                        'data_file': os.path.basename(data_file), 'time': datetime.now().isoformat(timespec='seconds')},
+                       sync=fsync_policy != "off")
+        return journal
+
+    @classmethod
+    def resume(cls, state, data_file, fsync_policy=JOURNAL_FSYNC_POLICY, io=None):
+        journal = cls(state['path'], fsync_policy, io)
+        journal.append({'type': 'resume', 'from_index': len(state['completed']), 'data_file': os.path.basename(data_file),
+                        'time': datetime.now().isoformat(timespec='seconds')}, sync=fsync_policy != "off")
+        return journal
+
+    def append(self, record, sync=False):
+        self.file.write(json.dumps(record) + "\n"); self.file.flush()
+        if sync or self.fsync_policy == "trial": os.fsync(self.file.fileno())
+
+    def record_trial(self, index, trial_info, discomfort, brightness_rating):
+        self.io.submit(self.append, {'type': 'trial', 'index': index, 'trial_number': trial_info.trial_number,
+                     'discomfort': int(discomfort), 'brightness': int(brightness_rating),
+                     'time': datetime.now().isoformat(timespec='milliseconds')})
+
+    def close(self, status):
+        """ status: 'complete' or 'abandoned' (never offered for resume again), or 'stopped'. Only the first call counts. """
+        if self.closed: return
+        self.closed = True
+        self.io.submit(self._close, {'type': status, 'time': datetime.now().isoformat(timespec='seconds')})
+
+    def _close(self, record):
+        try: self.append(record, sync=self.fsync_policy != "off")
+        finally: self.file.close(); self.file = None
+
+    @staticmethod
+    def read(path):
+        """ Parses a journal, ignoring a torn final line. Returns None if the header is unreadable. """
+        state = {'path': path, 'header': None, 'completed': [], 'status': None, 'segments': 0, 'data_files': []}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try: rec = json.loads(line)
+                except ValueError: continue # torn by a crash
+                kind = rec.get('type')
+                if kind in ('session', 'resume'):
+                    if kind == 'session': state['header'] = rec
+                    state['segments'] += 1; state['data_files'].append(rec['data_file']); state['status'] = None
+                elif kind == 'trial':
+                    if rec['index'] == len(state['completed']): state['completed'].append(rec)
+                else: state['status'] = kind
+        return state if state['header'] else None
+
+    @classmethod
+    def find_unfinished(cls, log_dir, participant_id, master_csv_path, num_trials, catalog=None):
+        """ Newest journal for this participant and master CSV (same content) that stopped part-way through.
+        Candidates are the catalog's unfinished runs (when a catalog is given) plus the journals in the log directory,
+        so a run the catalog missed (failed registration, shared log folder, older journal) is still found. """
+        digest = cls.master_digest(master_csv_path)
+        candidates = catalog.unfinished_journals(participant_id, digest) if catalog else []
+        candidates += glob.glob(os.path.join(log_dir, f"journal_P{glob.escape(participant_id)}_*.jsonl"))
+        for path in sorted({os.path.abspath(p) for p in candidates}, key=os.path.basename, reverse=True): # newest first
+            try: state = cls.read(path)
+            except (OSError, KeyError) as e: log(f"Skipping unreadable journal {path}: {e}"); continue
+            if not state or state['header'].get('master_sha1') != digest or state['status'] in ('complete', 'abandoned'): continue
+            if 0 < len(state['completed']) < num_trials and state['header'].get('trials') == num_trials: return state
+        return None
+
+    @staticmethod
+    def abandon(state):
+        """ Marks an unfinished session as declined so it is not offered again. """
+        SessionJournal(state['path'], "session").close('abandoned')
+
+# --- Experiment Catalog ---
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    return h.hexdigest()
+
+class ExperimentCatalog:
+    """ SQLite index of experiments, brightness schedules, master CSVs (by content hash), stimulus images and runs.
+    WAL journaling lets several processes read while one writes; each call uses its own short-lived connection and
+    transaction, waiting up to CATALOG_BUSY_TIMEOUT_S for a busy writer. Catalog failures are logged, never raised
+    into a session. """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS experiments (exp_id TEXT PRIMARY KEY, created TEXT);
+        CREATE TABLE IF NOT EXISTS schedules (id INTEGER PRIMARY KEY, exp_id TEXT NOT NULL, path TEXT NOT NULL, sha1 TEXT NOT NULL,
+                                              n_trials INTEGER, created TEXT, UNIQUE (path, sha1));
+        CREATE TABLE IF NOT EXISTS setups (id INTEGER PRIMARY KEY, exp_id TEXT NOT NULL, path TEXT NOT NULL, sha1 TEXT NOT NULL,
+                                           n_trials INTEGER, params TEXT, schedule_sha1 TEXT, created TEXT, UNIQUE (path, sha1));
+        CREATE TABLE IF NOT EXISTS images (sha1 TEXT NOT NULL, path TEXT NOT NULL, size INTEGER, registered TEXT,
+                                           PRIMARY KEY (sha1, path));
+        CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, exp_id TEXT, participant_id TEXT NOT NULL, setup_sha1 TEXT,
+                                         master_csv TEXT, image1 TEXT, image2 TEXT, image1_sha1 TEXT, image2_sha1 TEXT,
+                                         data_file TEXT UNIQUE, journal TEXT, station TEXT, started TEXT, ended TEXT,
+                                         status TEXT, trials_completed INTEGER, trials_total INTEGER);
+        CREATE INDEX IF NOT EXISTS schedules_exp ON schedules (exp_id, created);
+        CREATE INDEX IF NOT EXISTS setups_sha1 ON setups (sha1);
+        CREATE INDEX IF NOT EXISTS setups_exp ON setups (exp_id, created);
+        CREATE INDEX IF NOT EXISTS runs_exp ON runs (exp_id, started);
+        CREATE INDEX IF NOT EXISTS runs_participant ON runs (participant_id, setup_sha1, status);
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path, self.ready = path, False
+
+    def connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=CATALOG_BUSY_TIMEOUT_S)
+        conn.row_factory = sqlite3.Row
+        if not self.ready:
+            conn.execute("PRAGMA journal_mode=WAL"); conn.executescript(self.SCHEMA); self.ready = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def execute(self, sql, args=(), many=False):
+        """ Runs one write in its own transaction; returns lastrowid, or None if the catalog is unavailable. """
+        try:
+            conn = self.connect()
+            try:
+                with conn: cur = conn.executemany(sql, args) if many else conn.execute(sql, args)
+                return cur.lastrowid
+            finally: conn.close()
+        except sqlite3.Error as e: log(f"Catalog write failed ({self.path}): {e}"); return None
+
+    def query(self, sql, args=()):
         try:
-            with open(fn, 'w', newline='', encoding='utf-8') as f:
-                csv.writer(f).writerows([
-                    ['Participant_ID', self.participant_id], ['Timestamp_Summary', datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
-                    ['Number_Of_Rated_Trials', self.num_ratings], [], ['Metric', 'Average_Score_0_100'],
-                    ['Average_Discomfort', f"{avg_d:.2f}"], ['Average_Brightness', f"{avg_b:.2f}"]])
-            print(f"Average scores saved to: {fn}")
-        except Exception as e: print(f"Error saving summary scores {fn}: {e}")
+            conn = self.connect()
+            try: return [dict(r) for r in conn.execute(sql, args)]
+            finally: conn.close()
+        except sqlite3.Error as e: log(f"Catalog query failed ({self.path}): {e}"); return []
+
+    @staticmethod
+    def now(): return datetime.now().isoformat(timespec='seconds')
+
+    @staticmethod
+    def sha1(path):
+        try: return file_sha1(path)
+        except OSError as e: log(f"Catalog: cannot hash {path}: {e}"); return None
+
+    # Registration
+    def register_experiment(self, exp_id):
+        self.execute("INSERT OR IGNORE INTO experiments VALUES (?, ?)", (exp_id, self.now()))
+
+    def register_schedule(self, exp_id, path, n_trials):
+        self.register_experiment(exp_id)
+        sha1 = self.sha1(path)
+        if sha1: self.execute("INSERT OR IGNORE INTO schedules (exp_id, path, sha1, n_trials, created) VALUES (?, ?, ?, ?, ?)",
+                              (exp_id, os.path.abspath(path), sha1, n_trials, self.now()))
+
+    def register_setup(self, exp_id, path, n_trials, params=None, schedule_path=None):
+        self.register_experiment(exp_id)
+        sha1 = self.sha1(path)
+        if sha1: self.execute("INSERT OR IGNORE INTO setups (exp_id, path, sha1, n_trials, params, schedule_sha1, created) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?)", (exp_id, os.path.abspath(path), sha1, n_trials, json.dumps(params or {}),
+                                                               self.sha1(schedule_path) if schedule_path else None, self.now()))
+        return sha1
+
+    def register_image(self, path):
+        sha1 = self.sha1(path) if path and os.path.isfile(path) else None
+        if sha1: self.execute("INSERT OR IGNORE INTO images VALUES (?, ?, ?, ?)",
+                              (sha1, os.path.abspath(path), os.path.getsize(path), self.now()))
+        return sha1
+
+    def register_run(self, exp_id, participant_id, master_csv_path, setup_sha1, image_paths, data_file, journal_path, trials_total):
+        """ image_paths: the two stimulus files, or names describing a generated pair (stored without a hash). """
+        hashes = [self.register_image(p) for p in image_paths]
+        return self.execute("INSERT OR REPLACE INTO runs (exp_id, participant_id, setup_sha1, master_csv, image1, image2, "
+                            "image1_sha1, image2_sha1, data_file, journal, station, started, status, trials_completed, trials_total) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'running', 0, ?)",
+                            (exp_id, participant_id, setup_sha1, os.path.abspath(master_csv_path), *image_paths, *hashes,
+                             os.path.abspath(data_file), os.path.abspath(journal_path) if journal_path else None,
+                             platform.node(), self.now(), trials_total))
+
+    def finish_run(self, data_file, status, trials_completed):
+        self.execute("UPDATE runs SET status = ?, trials_completed = ?, ended = ? WHERE data_file = ?",
+                     (status, trials_completed, self.now(), os.path.abspath(data_file)))
+
+    # Queries
+    def experiment_for_setup(self, setup_sha1):
+        rows = self.query("SELECT exp_id FROM setups WHERE sha1 = ? ORDER BY created DESC LIMIT 1", (setup_sha1,))
+        return rows[0]['exp_id'] if rows else None
+
+    def latest_schedule(self, exp_id):
+        rows = self.query("SELECT path FROM schedules WHERE exp_id = ? ORDER BY created DESC, id DESC LIMIT 1", (exp_id,))
+        return rows[0]['path'] if rows else None
+
+    def runs(self, exp_id=None, participant_id=None):
+        where = [c for c, v in (("exp_id = ?", exp_id), ("participant_id = ?", participant_id)) if v is not None]
+        return self.query("SELECT * FROM runs" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY started",
+                          tuple(v for v in (exp_id, participant_id) if v is not None))
+
+    def unfinished_journals(self, participant_id, setup_sha1):
+        """ Journals of this participant's runs of this master CSV that did not complete, newest first. """
+        rows = self.query("SELECT journal FROM runs WHERE participant_id = ? AND setup_sha1 = ? AND status != 'complete' "
+                          "AND journal IS NOT NULL ORDER BY started DESC", (participant_id, setup_sha1))
+        return list(dict.fromkeys(r['journal'] for r in rows))
+
+# --- Session Clocks ---
+class SystemClock:
+    """ Real time for the session loop: perf_counter, sleeps and blocking pygame event waits. mark() splits the
+    session into phases (instructions, fixation, stimulus, ratings, ...) and accumulates time spent in each. """
+    def __init__(self):
+        self.phase, self.phase_start, self.phase_wall_start = None, 0.0, 0.0
+        self.phase_totals = OrderedDict() # phase -> [count, clock seconds, wall seconds]
+
+    def now(self): return time.perf_counter()
+
+    def sleep(self, seconds): time.sleep(seconds)
+
+    def wait_event(self, timeout_ms=None):
+        """ Next event, or NOEVENT after timeout_ms (None blocks until something arrives). """
+        return pygame.event.wait(timeout_ms) if timeout_ms else pygame.event.wait()
+
+    def spin_until(self, t):
+        while time.perf_counter() < t: pass
+
+    def mark(self, phase, **info):
+        """ Closes the current phase and starts the next one (None just closes it). """
+        now, wall = self.now(), time.perf_counter()
+        if self.phase is not None:
+            tot = self.phase_totals.setdefault(self.phase, [0, 0.0, 0.0])
+            tot[0] += 1; tot[1] += now - self.phase_start; tot[2] += wall - self.phase_wall_start
+        self.phase, self.phase_start, self.phase_wall_start = phase, now, wall
+
+    def phase_report(self):
+        return {phase: {'count': n, 'clock_s': round(clock_s, 6), 'wall_s': round(wall_s, 6)}
+                for phase, (n, clock_s, wall_s) in self.phase_totals.items()}
+
+    def print_phase_report(self):
+        for phase, r in self.phase_report().items():
+            log(f"Phase {phase:<24} x{r['count']:<4} clock {r['clock_s']:9.3f} s  wall {r['wall_s']:9.3f} s")
+
+class VirtualClock(SystemClock):
+    """ Simulated time for headless runs: now() only moves when the session waits, sleeps or spins, so a full session
+    runs as fast as the CPU allows. Input comes from the participant, whose events are posted when they fall due. """
+    def __init__(self, participant=None):
+        super().__init__()
+        self.t, self.participant = 0.0, participant
+
+    def now(self): return self.t
+
+    def sleep(self, seconds): self.t += max(0.0, seconds)
+
+    def spin_until(self, t): self.t = max(self.t, t)
+
+    def wait_event(self, timeout_ms=None):
+        ev = pygame.event.poll()
+        if ev.type != pygame.NOEVENT: return ev
+        limit = self.t + timeout_ms / 1000.0 if timeout_ms else None
+        due = self.participant.next_due() if self.participant else None
+        if due is not None and (limit is None or due <= limit):
+            self.t = max(self.t, due); self.participant.post_due(self.t)
+            return pygame.event.poll()
+        if limit is None: raise RuntimeError("Simulation stalled: waiting for input the scripted participant never sends.")
+        self.t = limit
+        return pygame.event.Event(pygame.NOEVENT)
+
+    def mark(self, phase, **info):
+        super().mark(phase, **info)
+        if self.participant and phase is not None: self.participant.on_phase(phase, self, info)
+
+class ScriptedParticipant:
+    """ Stand-in participant for VirtualClock sessions. Presses a key on every waiting message and, on each rating
+    screen, drags the slider to a target and clicks Confirm, with randomized reaction times. Ratings track the trial's
+    brightness_factor (x100) plus Gaussian noise, so a simulated run yields a plausible brightness-response curve. """
+    def __init__(self, seed=None, reaction_s=(0.4, 1.6), noise=8.0, drag_steps=6):
+        self.rng = random.Random(seed)
+        self.reaction_s, self.noise, self.drag_steps = reaction_s, noise, drag_steps
+        self.pending, self.seq = [], 0 # heap of (due_t, seq, event)
+        self.brightness_factor = 0.5
+
+    def reaction(self): return self.rng.uniform(*self.reaction_s)
+
+    def schedule(self, t, type_, **attrs):
+        heapq.heappush(self.pending, (t, self.seq, pygame.event.Event(type_, **attrs))); self.seq += 1
+
+    def next_due(self): return self.pending[0][0] if self.pending else None
+
+    def post_due(self, t):
+        while self.pending and self.pending[0][0] <= t: pygame.event.post(heapq.heappop(self.pending)[2])
+
+    def on_phase(self, phase, clock, info):
+        t = clock.now()
+        if 'trial' in info: self.brightness_factor = info['trial'].brightness_factor
+        if phase == "message" and info.get('wait_for_key'):
+            self.schedule(t + self.reaction(), pygame.KEYDOWN, key=pygame.K_SPACE, mod=0, unicode=" ", scancode=0)
+        elif phase.startswith("rating_"):
+            scale = info['scale']
+            target = min(100.0, max(0.0, 100.0 * self.brightness_factor + self.rng.gauss(0.0, self.noise)))
+            y = scale.scale_y + scale.scale_height // 2
+            x0 = scale.scale_x + int(scale.scale_width * self.rng.random())
+            x1 = scale.scale_x + int(round(scale.scale_width * target / 100.0))
+            t += self.reaction()
+            self.schedule(t, pygame.MOUSEBUTTONDOWN, pos=(x0, y), button=1)
+            for i in range(1, self.drag_steps + 1):
+                t += self.rng.uniform(0.015, 0.05)
+                x = x0 + (x1 - x0) * i // self.drag_steps
+                self.schedule(t, pygame.MOUSEMOTION, pos=(x, y), rel=(0, 0), buttons=(1, 0, 0))
+            self.schedule(t + 0.05, pygame.MOUSEBUTTONUP, pos=(x1, y), button=1)
+            self.schedule(t + 0.05 + self.reaction(), pygame.MOUSEBUTTONDOWN, pos=scale.confirm_button_rect.center, button=1)
+
+SYSTEM_CLOCK = SystemClock()
+
+# --- Display Backends ---
+class SurfaceDisplay:
+    """ Default backend: draws on the pygame display surface and presents with display.flip(). """
+    name = RENDERER_SURFACE
+    background_prepare = True # prepare_board only builds surfaces, so it may run on a worker thread
+
+    def __init__(self, surface, engine=None):
+        self.surface = surface
+        self.engine = engine or DEFAULT_BRIGHTNESS_ENGINE
+
+    def flip(self): pygame.display.flip()
+
+    def update(self, rects): pygame.display.update(rects)
+
+    def prepare_board(self, board, factor, surface_cache=None):
+        if isinstance(board, IndexedBoard): return board.render(factor, self.engine)
+        return surface_cache.get(board, factor) if surface_cache else self.engine.apply(board, factor)
+
+    def prepare_session(self, boards, factors, surface_cache=None):
+        if surface_cache: surface_cache.prefill([b for b in boards if not isinstance(b, IndexedBoard)], factors)
+
+    def show_board(self, board):
+        self.surface.fill(BLACK); self.surface.blit(board, (0,0)); pygame.display.flip()
+
+    def close(self): pass
+
+class Sdl2TextureDisplay:
+    """ pygame._sdl2 backend: each board is uploaded once as a texture and dimmed per draw by colour modulation.
+    UI screens are drawn into an off-screen surface that is streamed to a canvas texture on flip/update. """
+    name = RENDERER_SDL2
+    background_prepare = False # textures belong to the renderer's thread
+
+    def __init__(self, size, vsync=False, software=True):
+        from pygame._sdl2 import video
+        self.video = video
+        self.window = video.Window("M-VAST 3 Visual Stimulus", size=size, fullscreen_desktop=True)
+        # accelerated=0 selects SDL's software renderer, so no GPU is required
+        self.renderer = video.Renderer(self.window, accelerated=0 if software else -1, vsync=vsync)
+        self.renderer.draw_color = (0, 0, 0, 255)
+        self.surface = pygame.Surface(self.window.size)
+        self.canvas = video.Texture(self.renderer, self.window.size, streaming=True)
+        self.board_textures = {}
+        self.engine = DEFAULT_BRIGHTNESS_ENGINE
+
+    def _present_canvas(self):
+        self.renderer.clear(); self.canvas.draw(); self.renderer.present()
+
+    def flip(self):
+        self.canvas.update(self.surface); self._present_canvas()
+
+    def update(self, rects):
+        bounds = self.surface.get_rect()
+        for r in rects:
+            r = pygame.Rect(r).clip(bounds)
+            if r.width and r.height: self.canvas.update(self.surface.subsurface(r), area=r)
+        self._present_canvas()
+
+    def _texture(self, board):
+        tex = self.board_textures.get(board)
+        if tex is None:
+            sf = board.to_surface() if isinstance(board, IndexedBoard) else board
+            tex = self.board_textures[board] = self.video.Texture.from_surface(self.renderer, sf)
+            tex.blend_mode = 0 # boards are opaque; frombuffer-mapped frames would otherwise alpha-blend
+        return tex
+
+    def prepare_board(self, board, factor, surface_cache=None):
+        level = self.engine.level(factor)
+        return self._texture(board), (level, level, level)
+
+    def prepare_session(self, boards, factors, surface_cache=None):
+        for board in boards: self._texture(board)
+
+    def show_board(self, board):
+        tex, color = board
+        tex.color = color
+        self.renderer.clear(); tex.draw(); self.renderer.present()
+
+    def close(self):
+        self.board_textures.clear(); self.window.destroy()
+
+def as_display(screen):
+    """ Lets the helpers take either a display backend or a bare pygame surface. """
+    return screen if hasattr(screen, 'show_board') else SurfaceDisplay(screen)
 
 # --- Pygame Helper Functions ---
-def load_checkerboard_images(screen_width, screen_height, img1_path, img2_path):
+class ScaledFrameCache:
+    """ On-disk cache of pre-scaled stimulus frames stored as raw pixels in the display's own layout, keyed by (file
+    content hash, target resolution, pixel layout). A hit is read straight into a surface of that layout, so there is
+    no PNG decode, rescale or pixel conversion; only 32-bit layouts are cached. """
+    def __init__(self, cache_dir=FRAME_CACHE_DIR, max_bytes=FRAME_CACHE_MAX_BYTES):
+        self.cache_dir, self.max_bytes = cache_dir, max_bytes
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def pixel_layout():
+        """ (bitsize, masks) of the open display, else of pygame's default 32-bit surface. """
+        ref = pygame.display.get_surface() or pygame.Surface((1, 1), 0, 32)
+        return ref.get_bitsize(), ref.get_masks()
+
+    @staticmethod
+    def file_hash(path):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''): h.update(chunk)
+        return h.hexdigest()
+
+    def entry_path(self, image_path, size, layout):
+        bits, masks = layout
+        return os.path.join(self.cache_dir, f"{self.file_hash(image_path)[:32]}_{size[0]}x{size[1]}_"
+                                            f"{bits}b_{'_'.join(f'{m:x}' for m in masks)}.raw")
+
+    def load(self, image_path, size):
+        layout = self.pixel_layout()
+        path = self.entry_path(image_path, size, layout)
+        try:
+            if layout[0] == 32 and os.path.getsize(path) == size[0] * size[1] * 4:
+                surf = pygame.Surface(size, 0, *layout)
+                with open(path, 'rb') as f: f.readinto(surf.get_view('0'))
+                os.utime(path) # mtime doubles as the LRU stamp
+                self.hits += 1
+                return surf
+        except (OSError, ValueError, pygame.error): pass
+        self.misses += 1
+        surf = pygame.image.load(image_path)
+        surf = surf.convert() if pygame.display.get_surface() else surf.convert(32)
+        surf = pygame.transform.scale(surf, size)
+        if (surf.get_bitsize(), surf.get_masks()) == layout and layout[0] == 32: self.store(path, surf)
+        return surf
+
+    def store(self, path, surf):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp, 'wb') as f: f.write(surf.get_view('0'))
+            os.replace(tmp, path) # atomic, so concurrent readers never map a half-written frame
+            self.evict()
+        except OSError as e:
+            log(f"Could not write frame cache entry {path}: {e}")
+            if os.path.exists(tmp): os.remove(tmp)
+
+    def evict(self):
+        """ Deletes least recently used entries until the cache fits in max_bytes. """
+        entries = []
+        for fp in glob.glob(os.path.join(self.cache_dir, "*.raw")):
+            try: st = os.stat(fp); entries.append((st.st_mtime, st.st_size, fp))
+            except OSError: pass
+        total = sum(e[1] for e in entries)
+        for _, size, fp in sorted(entries):
+            if total <= self.max_bytes: break
+            try: os.remove(fp); total -= size
+            except OSError: pass
+
+def warm_frame_cache(size, image_paths, frame_cache=None):
+    """ Pre-scales image_paths to size so the first run at that resolution maps frames straight from disk. """
+    frame_cache = frame_cache or ScaledFrameCache()
+    for path in image_paths:
+        t0 = time.perf_counter()
+        frame_cache.load(path, size)
+        log(f"Cached {os.path.basename(path)} at {size[0]}x{size[1]} ({(time.perf_counter()-t0)*1000:.0f} ms)")
+    return frame_cache
+
+def check_size_to_px(check_size, units, screen_width_px, screen_width_cm=DEFAULT_SCREEN_WIDTH_CM,
+                     viewing_distance_cm=DEFAULT_VIEWING_DISTANCE_CM):
+    """ Converts a check size in px or degrees of visual angle to whole pixels. """
+    if units == "deg":
+        size_cm = 2.0 * viewing_distance_cm * math.tan(math.radians(check_size) / 2.0)
+        check_size = size_cm * screen_width_px / screen_width_cm
+    return max(1, int(round(check_size)))
+
+@functools.lru_cache(maxsize=4)
+def _generate_checkerboard_pair(size, check_px, colors, layout, n_wedges, masks):
+    w, h = size
+    if layout == "grid":
+        parity = ((np.arange(w, dtype=np.int32) // check_px) & 1).astype(np.uint8)[:, None] ^ \
+                 ((np.arange(h, dtype=np.int32) // check_px) & 1).astype(np.uint8)[None, :]
+    else:
+        dx = (np.arange(w, dtype=np.float32) - (w - 1) / 2.0)[:, None]
+        dy = (np.arange(h, dtype=np.float32) - (h - 1) / 2.0)[None, :]
+        parity = (np.hypot(dx, dy) // check_px).astype(np.int32) & 1
+        if layout == "radial":
+            wedge = ((np.arctan2(dy, dx) + np.pi) * (n_wedges / (2.0 * np.pi))).astype(np.int32) % n_wedges
+            parity ^= wedge & 1
+        parity = parity.astype(np.uint8)
+    boards = []
+    for pair in (colors, colors[::-1]):
+        sf = pygame.Surface(size, 0, 32, masks)
+        mapped = np.array([sf.map_rgb(c) for c in pair], dtype=np.uint32)
+        px = pygame.surfarray.pixels2d(sf)
+        np.take(mapped, parity, out=px)
+        del px # release the surface lock
+        boards.append(sf)
+    return tuple(boards)
+
+def generate_checkerboard_pair(size, check_px, colors="bw", layout="grid", n_wedges=DEFAULT_CHECKER_WEDGES):
+    """ Builds a phase-reversed checkerboard pair at exact native resolution, memoized per parameter set.
+    colors is a CHECKER_COLOR_PAIRS key or a pair of RGB tuples; layout is one of CHECKER_LAYOUTS. """
+    if isinstance(colors, str): colors = CHECKER_COLOR_PAIRS[colors]
+    if layout not in CHECKER_LAYOUTS: raise ValueError(f"Unknown checkerboard layout: {layout}")
+    disp = pygame.display.get_surface()
+    masks = disp.get_masks() if disp is not None and disp.get_bitsize() == 32 else (0xff0000, 0xff00, 0xff, 0)
+    return _generate_checkerboard_pair(tuple(size), int(check_px), tuple(tuple(c) for c in colors), layout, int(n_wedges), tuple(masks))
+
+def load_checkerboard_images(screen_width, screen_height, img1_path, img2_path, frame_cache=None):
     try:
         if not os.path.exists(img1_path): raise FileNotFoundError(f"Img1 not found: {img1_path}")
         if not os.path.exists(img2_path): raise FileNotFoundError(f"Img2 not found: {img2_path}")
+        if frame_cache:
+            size = (screen_width, screen_height)
+            return frame_cache.load(img1_path, size), frame_cache.load(img2_path, size)
         b1_orig, b2_orig = pygame.image.load(img1_path), pygame.image.load(img2_path)
-        b1_orig, b2_orig = b1_orig.convert(), b2_orig.convert() 
+        if pygame.display.get_surface(): b1_orig, b2_orig = b1_orig.convert(), b2_orig.convert() 
+        else: b1_orig, b2_orig = b1_orig.convert(32), b2_orig.convert(32) # sdl2 backend: no display-mode surface
         b1_scaled = pygame.transform.scale(b1_orig, (screen_width, screen_height))
         b2_scaled = pygame.transform.scale(b2_orig, (screen_width, screen_height))
         return b1_scaled, b2_scaled
@@ -1295,29 +2421,282 @@ def load_checkerboard_images(screen_width, screen_height, img1_path, img2_path):
         messagebox.showerror("Image Load Error", f"Failed to load/scale images:\n{e}")
         return None, None
 
-def adjust_surface_brightness(surface, factor):
-    if factor >= 1.0: return surface
-    if factor <= 0.0: sf = pygame.Surface(surface.get_size()).convert(); sf.fill(BLACK); return sf
-    adj_sf = surface.copy()
-    try: adj_sf.fill((int(255*factor),)*3, special_flags=pygame.BLEND_RGB_MULT)
-    except: 
-        try:
-            arr = pygame.surfarray.pixels3d(adj_sf).astype(np.float32) * factor
-            pygame.surfarray.blit_array(adj_sf, np.clip(arr, 0, 255).astype(np.uint8))
-        except Exception as e_np:
-            print(f"NumPy brightness failed ({e_np}), slow fallback.")
-            for x in range(adj_sf.get_width()):
-                for y in range(adj_sf.get_height()):
-                    r,g,b,a = adj_sf.get_at((x,y)); adj_sf.set_at((x,y), (int(r*factor),int(g*factor),int(b*factor),a))
-    return adj_sf
-
-def show_message(screen, text, wait_for_key=True, escape_quits=True):
-    if not screen: print(f"show_message: No screen. Msg: {text}"); return True
+class BrightnessSurfaceCache:
+    """ LRU cache of brightness-adjusted stimulus surfaces keyed by (image, brightness_factor). Thread-safe, so the
+    trial prefetcher can fill it while the presentation thread reads; variants are built outside the lock. """
+    def __init__(self, byte_budget=STIMULUS_CACHE_BYTE_BUDGET, engine=None):
+        self.byte_budget, self.engine = byte_budget, engine or DEFAULT_BRIGHTNESS_ENGINE
+        self.entries = OrderedDict()
+        self.bytes_used = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def surface_bytes(surface):
+        return surface.get_pitch() * surface.get_height()
+
+    def get(self, image, factor):
+        key = (image, round(float(factor), 4))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key); self.hits += 1
+                return entry[0]
+            self.misses += 1
+        adj_sf = self.engine.apply(image, factor)
+        # factor >= 1.0 hands back the source surface itself, which costs nothing extra to keep
+        size = 0 if adj_sf is image else self.surface_bytes(adj_sf)
+        with self.lock:
+            if key in self.entries: return self.entries[key][0] # built concurrently by the other thread
+            self.entries[key] = (adj_sf, size); self.bytes_used += size
+            while self.bytes_used > self.byte_budget and len(self.entries) > 1:
+                _, (_, ev_size) = self.entries.popitem(last=False)
+                self.bytes_used -= ev_size; self.evictions += 1
+        return adj_sf
+
+    def prefill(self, images, factors):
+        """ Builds every (image, factor) variant, inserting the earliest-needed factors last so LRU keeps them. """
+        ordered = list(dict.fromkeys(round(float(f), 4) for f in factors))
+        evictions_before = self.evictions
+        for f in reversed(ordered):
+            for img in images: self.get(img, f)
+        if self.evictions > evictions_before:
+            log(f"Stimulus cache budget ({self.byte_budget // (1024*1024)} MB) too small for all "
+                  f"{len(ordered)} brightness levels; {self.evictions - evictions_before} variants will be rebuilt on demand.")
+        log(f"Stimulus cache: {len(self.entries)} surfaces, {self.bytes_used / (1024*1024):.1f} MB.")
+
+class BrightnessEngine:
+    """ Applies brightness_factor through a 256-entry uint8 lookup table, in place on the surface's pixel buffer.
+    With a display gamma the table scales linear luminance, v' = v * factor ** (1 / gamma); without one it scales
+    raw RGB values. Tracks how often each path ran and how long it took, including the LUT (indexed palettes) and
+    level (SDL colour modulation) lookups that other backends make instead of apply(). """
+    def __init__(self, gamma=None):
+        self.gamma = gamma
+        self.luts, self.pair_luts = {}, {}
+        self.stats = {} # path -> [calls, total ms]
+
+    def multiplier(self, factor):
+        factor = max(0.0, min(1.0, float(factor)))
+        return factor ** (1.0 / self.gamma) if self.gamma else factor
+
+    def level(self, factor):
+        """ The 0-255 modulation level equivalent to factor (used for SDL colour modulation). """
+        t0 = time.perf_counter()
+        return self._note("level", t0, int(round(255 * self.multiplier(factor))))
+
+    def lut(self, factor):
+        """ The 256-entry table for factor, counted as a cached or newly built lookup (apply() uses _table directly). """
+        t0 = time.perf_counter()
+        cached = round(float(factor), 4) in self.luts
+        return self._note("lut-cached" if cached else "lut-built", t0, self._table(factor))
+
+    def _table(self, factor):
+        key = round(float(factor), 4)
+        lut = self.luts.get(key)
+        if lut is None:
+            lut = self.luts[key] = np.clip(np.round(np.arange(256) * self.multiplier(key)), 0, 255).astype(np.uint8)
+        return lut
+
+    def pair_lut(self, factor, masks):
+        """ 65536-entry uint16 tables for the two byte pairs of a 32-bit pixel, so each pixel costs two lookups.
+        Bytes outside the RGB masks (alpha or padding) map to themselves. """
+        key = (round(float(factor), 4), masks)
+        pair = self.pair_luts.get(key)
+        if pair is None:
+            lut, ident, rgb = self._table(factor).astype(np.uint16), np.arange(256, dtype=np.uint16), masks[0] | masks[1] | masks[2]
+            shift = (lambda i: 8 * i) if sys.byteorder == 'little' else (lambda i: 8 * (3 - i))
+            byte_luts = [lut if (rgb >> shift(i)) & 0xff else ident for i in range(4)]
+            v = np.arange(65536)
+            pair = self.pair_luts[key] = tuple((byte_luts[i][v & 0xff] | (byte_luts[i + 1][v >> 8] << 8)).astype(np.uint16)
+                                               for i in (0, 2))
+        return pair
+
+    def apply(self, surface, factor):
+        """ Returns a dimmed copy of surface (or surface itself when factor >= 1). """
+        t0 = time.perf_counter()
+        if factor >= 1.0: return self._note("passthrough", t0, surface)
+        if factor <= 0.0:
+            sf = pygame.Surface(surface.get_size())
+            sf = sf.convert() if pygame.display.get_surface() else sf
+            return self._note("black", t0, sf)
+        path = "lut16"
+        if surface.get_bytesize() not in (3, 4): surface, path = surface.convert(32), "lut16-converted"
+        adj_sf = surface.copy()
+        buf = adj_sf.get_buffer()
+        if adj_sf.get_bytesize() == 4:
+            pairs = np.frombuffer(buf, dtype=np.uint16).reshape(-1, 2)
+            lo, hi = self.pair_lut(factor, tuple(adj_sf.get_masks()))
+            pairs[:, 0] = lo[pairs[:, 0]]; pairs[:, 1] = hi[pairs[:, 1]]
+            del pairs
+        else:
+            path = "lut8"
+            px = np.frombuffer(buf, dtype=np.uint8)
+            px[...] = self._table(factor)[px]
+            del px
+        del buf # releases the surface lock
+        return self._note(path, t0, adj_sf)
+
+    def _note(self, path, t0, result):
+        st = self.stats.setdefault(path, [0, 0.0])
+        st[0] += 1; st[1] += (time.perf_counter() - t0) * 1000.0
+        return result
+
+    def report(self):
+        gamma = f"gamma {self.gamma:g}" if self.gamma else "no gamma"
+        paths = ", ".join(f"{p} x{n} (avg {ms / n:.2f} ms)" for p, (n, ms) in self.stats.items())
+        log(f"Brightness engine ({gamma}): {paths or 'unused'}")
+
+DEFAULT_BRIGHTNESS_ENGINE = BrightnessEngine()
+
+def adjust_surface_brightness(surface, factor, engine=None):
+    return (engine or DEFAULT_BRIGHTNESS_ENGINE).apply(surface, factor)
+
+class IndexedBoard:
+    """ 8-bit stimulus frame: an index surface plus this frame's palette. Frames that are palette permutations of
+    one another (phase-reversed checkerboards, a blank) share one index surface, which saves memory. Each brightness
+    level still costs one full-frame 8- to 32-bit conversion in render(), though the dimming itself is a palette scale. """
+    def __init__(self, indices, palette, lock=None):
+        self.indices, self.palette = indices, tuple(tuple(c[:3]) for c in palette)
+        self.scaled = {}
+        self.lock = lock or threading.Lock() # one per index surface: its palette is also edited from the prefetch thread
+
+    def get_size(self): return self.indices.get_size()
+
+    def scaled_palette(self, factor, engine=None):
+        """ The palette dimmed through the brightness engine's LUT, identical to dimming the full-colour board. """
+        engine = engine or DEFAULT_BRIGHTNESS_ENGINE
+        key = (round(float(factor), 4), engine.gamma)
+        if key not in self.scaled:
+            lut = engine.lut(factor)
+            self.scaled[key] = [tuple(int(v) for v in lut[list(c)]) for c in self.palette]
+        return self.scaled[key]
+
+    def render(self, factor, engine=None):
+        """ The frame at this brightness in the display's format, built once per ring (a palette edit plus one
+        8- to 32-bit conversion) so every flip stays a plain 32-bit blit. """
+        with self.lock:
+            self.indices.set_palette(self.scaled_palette(factor, engine))
+            return self.indices.convert() if pygame.display.get_surface() else self.indices.convert(32)
+
+    def to_surface(self):
+        sf = self.indices.copy(); sf.set_palette(self.palette)
+        return sf.convert() if pygame.display.get_surface() else sf.convert(32)
+
+def palettize_surfaces(surfaces, max_colors=256):
+    """ Returns surfaces with each eligible (32-bit, <= max_colors colours) one replaced by an IndexedBoard; the rest
+    are passed through for the full-colour path. A surface whose colour is a function of an earlier board's indices
+    reuses that board's index surface. """
+    out, layouts = [], [] # layouts: (index array, index surface, colour count, lock shared by its boards)
+    for sf in surfaces:
+        if not isinstance(sf, pygame.Surface) or sf.get_bitsize() != 32: out.append(sf); continue
+        px = pygame.surfarray.array2d(sf).astype(np.uint32)
+        board = None
+        for idx, isf, n, lock in layouts:
+            lut = np.zeros(n, dtype=np.uint32); lut[idx] = px
+            if np.array_equal(lut[idx], px):
+                board = IndexedBoard(isf, [sf.unmap_rgb(int(v)) for v in lut], lock); break
+        if board is None:
+            colors = np.unique(px[::7, ::7]) # cheap sample rejects photographic images early
+            if len(colors) <= max_colors:
+                idx = np.searchsorted(colors, px).clip(0, len(colors) - 1)
+                if not np.array_equal(colors[idx], px):
+                    colors, idx = np.unique(px, return_inverse=True); idx = idx.reshape(px.shape)
+            if len(colors) <= max_colors:
+                idx = idx.astype(np.uint8)
+                isf = pygame.Surface(sf.get_size(), 0, 8)
+                palette = [sf.unmap_rgb(int(v)) for v in colors]
+                isf.set_palette(palette)
+                pygame.surfarray.blit_array(isf, idx)
+                board = IndexedBoard(isf, palette)
+                layouts.append((idx, isf, len(colors), board.lock))
+        out.append(board if board is not None else sf)
+    n_indexed = sum(isinstance(b, IndexedBoard) for b in out)
+    if n_indexed:
+        saved = sum(sf.get_pitch() * sf.get_height() for sf, b in zip(surfaces, out) if isinstance(b, IndexedBoard))
+        kept = sum(isf.get_pitch() * isf.get_height() for _, isf, _, _ in layouts)
+        log(f"Indexed colour: {n_indexed}/{len(out)} frames on {len(layouts)} index surface(s), "
+              f"{kept / (1024*1024):.1f} MB instead of {saved / (1024*1024):.1f} MB per brightness level.")
+    return out
+
+class TextCache:
+    """ Font registry keyed by (face, size) plus an LRU cache of rendered text keyed by (font, text, colour), so
+    screens built every trial reuse fonts and glyph surfaces instead of reloading and re-rendering them. """
+    def __init__(self, max_entries=TEXT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.fonts, self.rendered = {}, OrderedDict()
+        self.font_hits, self.font_misses, self.hits, self.misses = 0, 0, 0, 0
+
+    def font(self, size, face=None):
+        key = (face, size)
+        f = self.fonts.get(key)
+        if f is not None: self.font_hits += 1; return f
+        self.font_misses += 1
+        try: f = pygame.font.Font(face, size)
+        except: f = pygame.font.SysFont("arial", size)
+        self.fonts[key] = f
+        return f
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, tuple(color), antialias)
+        ts = self.rendered.get(key)
+        if ts is not None:
+            self.rendered.move_to_end(key); self.hits += 1
+            return ts
+        self.misses += 1
+        ts = self.rendered[key] = font.render(text, antialias, color)
+        if len(self.rendered) > self.max_entries: self.rendered.popitem(last=False)
+        return ts
+
+    def stats(self):
+        return {'font_hits': self.font_hits, 'font_misses': self.font_misses, 'text_hits': self.hits,
+                'text_misses': self.misses, 'text_entries': len(self.rendered)}
+
+    def report(self):
+        st = self.stats()
+        log(f"Text cache: fonts {st['font_hits']} hits / {st['font_misses']} loads, "
+              f"text {st['text_hits']} hits / {st['text_misses']} renders ({st['text_entries']} cached).")
+
+    def clear(self):
+        """ Font objects die with pygame.font, so this must run whenever pygame is shut down. """
+        self.fonts.clear(); self.rendered.clear()
+
+TEXT_CACHE = TextCache()
+
+def wait_for_events(deadline=None, handle_event=None, spin_window=FRAME_SPIN_WINDOW_S, clock=None):
+    """ Blocks on the event queue until deadline (a clock time; None waits indefinitely), passing each event
+    to handle_event. Returns the handler's first non-None result, or None once the deadline is reached. The last
+    spin_window is spun so the return lands on the deadline rather than on a timer tick. """
+    clock = clock or SYSTEM_CLOCK
+    while True:
+        if deadline is None: ev = clock.wait_event()
+        else:
+            block = deadline - clock.now() - spin_window - EVENT_WAIT_SLACK_S
+            if block < 0.001: break
+            ev = clock.wait_event(int(block * 1000))
+        if ev.type != pygame.NOEVENT and handle_event is not None:
+            result = handle_event(ev)
+            if result is not None: return result
+    for ev in pygame.event.get():
+        result = handle_event(ev) if handle_event is not None else None
+        if result is not None: return result
+    clock.spin_until(deadline)
+    return None
+
+def quit_or_escape(escape_quits=True):
+    """ Event handler for wait_for_events: False on window close (or ESC when escape_quits), else keep waiting. """
+    def handle_event(ev):
+        if ev.type == pygame.QUIT: return False
+        if escape_quits and ev.type == pygame.KEYDOWN and ev.key == pygame.K_ESCAPE: return False
+        return None
+    return handle_event
+
+def show_message(screen, text, wait_for_key=True, escape_quits=True, clock=None):
+    if not screen: log(f"show_message: No screen. Msg: {text}"); return True
+    clock = clock or SYSTEM_CLOCK
+    display = as_display(screen); screen = display.surface
     screen.fill(BLACK)
     pg_sf = max(0.5, min(3.0, screen.get_height() / PYGAME_REFERENCE_SCREEN_HEIGHT))
-    font_size = int(38 * pg_sf) 
-    try: font = pygame.font.Font(None, font_size)
-    except: font = pygame.font.SysFont("arial", font_size)
+    font = TEXT_CACHE.font(int(38 * pg_sf))
     
     lines = [l.strip() for l in text.split('\n')]
     r_lines, total_h = [], 0
@@ -1326,7 +2705,7 @@ def show_message(screen, text, wait_for_key=True, escape_quits=True):
 
     for l_txt in lines:
         if l_txt: 
-            ts = font.render(l_txt, True, WHITE)
+            ts = TEXT_CACHE.render(font, l_txt, WHITE)
             r_lines.append(ts)
             total_h += ts.get_height()
         else: 
@@ -1346,103 +2725,443 @@ def show_message(screen, text, wait_for_key=True, escape_quits=True):
             curr_y += ts.get_height() + (scaled_line_h - base_line_h) 
         else: 
              curr_y += scaled_line_h // 2
-    pygame.display.flip()
+    display.flip()
+    clock.mark("message", wait_for_key=wait_for_key)
     
     if wait_for_key:
-        while True:
-            for ev in pygame.event.get():
-                if ev.type == pygame.QUIT: pygame.quit(); sys.exit()
-                if ev.type == pygame.KEYDOWN: return not (escape_quits and ev.key == pygame.K_ESCAPE)
-            pygame.time.wait(10)
+        def handle_event(ev):
+            if ev.type == pygame.QUIT: pygame.quit(); sys.exit()
+            if ev.type == pygame.KEYDOWN: return not (escape_quits and ev.key == pygame.K_ESCAPE)
+            return None
+        return wait_for_events(None, handle_event, clock=clock)
     return True
 
-def get_rating_with_click(screen, title_ignored, scale_type="unpleasantness"): 
+def get_rating_with_click(screen, title_ignored, scale_type="unpleasantness", trajectory=None, clock=None): 
     pygame.mouse.set_visible(True)
+    clock = clock or SYSTEM_CLOCK
+    display = as_display(screen); screen = display.surface
     scale = RatingScale(screen, title_ignored, scale_type=scale_type) 
-    clock = pygame.time.Clock()
+    scale.draw(); display.flip()
+    if trajectory: trajectory.begin(clock.now())
+    clock.mark("rating_" + scale_type, scale=scale)
+    drawn = scale.state()
     while True:
-        for ev in pygame.event.get():
+        # Block until input arrives, then handle everything queued before redrawing once
+        for ev in [clock.wait_event()] + pygame.event.get():
             if ev.type == pygame.QUIT: pygame.quit(); sys.exit()
             if ev.type == pygame.KEYDOWN and ev.key == pygame.K_ESCAPE: pygame.mouse.set_visible(False); return None
-            if scale.handle_event(ev) == "confirmed": pygame.mouse.set_visible(False); return scale.value
-        screen.fill(BLACK); scale.draw(); pygame.display.flip(); clock.tick(60)
-
-def show_fixation(screen, duration, escape_quits=True):
-    pygame.mouse.set_visible(False); screen.fill(BLACK)
+            result = scale.handle_event(ev)
+            if trajectory and ev.type in RatingTrajectory.EVENT_CODES:
+                code = RatingTrajectory.CONFIRM if result == "confirmed" else RatingTrajectory.EVENT_CODES[ev.type]
+                trajectory.record(clock.now(), ev.pos[0], scale.value, code)
+            if result == "confirmed": pygame.mouse.set_visible(False); return scale.value
+        if scale.state() != drawn:
+            display.update(scale.redraw()); drawn = scale.state()
+
+def show_fixation(screen, duration, escape_quits=True, clock=None):
+    pygame.mouse.set_visible(False)
+    clock = clock or SYSTEM_CLOCK
+    display = as_display(screen); screen = display.surface
+    screen.fill(BLACK)
     pg_sf = max(0.5, min(3.0, screen.get_height() / PYGAME_REFERENCE_SCREEN_HEIGHT))
-    font_size = int(72 * pg_sf) 
-    try: font = pygame.font.Font(None, font_size)
-    except: font = pygame.font.SysFont("arial", font_size)
-    ts = font.render('+', True, WHITE)
+    ts = TEXT_CACHE.render(TEXT_CACHE.font(int(72 * pg_sf)), '+', WHITE)
     screen.blit(ts, ts.get_rect(center=(screen.get_width()//2, screen.get_height()//2)))
-    pygame.display.flip()
-    start_t = time.perf_counter()
-    while time.perf_counter() - start_t < duration:
+    display.flip()
+    clock.mark("fixation", duration=duration)
+    return wait_for_events(clock.now() + duration, quit_or_escape(escape_quits), clock=clock) is None
+
+class FrameScheduler:
+    """ Deadline-driven hybrid sleep/spin scheduler. period is a single frame duration or a cycle of per-frame
+    hold times; deadlines stay phase-locked to start_t (cycle offsets are never accumulated frame by frame). """
+    MISS_SKIP, MISS_LATE = "skip", "late"
+
+    def __init__(self, period, miss_policy=FRAME_MISS_POLICY, spin_window=FRAME_SPIN_WINDOW_S,
+                 late_tolerance=FRAME_LATE_TOLERANCE_S, clock=None):
+        if miss_policy not in (self.MISS_SKIP, self.MISS_LATE): raise ValueError(f"Unknown miss policy: {miss_policy}")
+        holds = (float(period),) if isinstance(period, (int, float)) else tuple(float(h) for h in period)
+        self.offsets = list(itertools.accumulate(holds, initial=0.0))
+        self.cycle, self.n_holds = self.offsets[-1], len(holds)
+        self.miss_policy, self.clock = miss_policy, clock or SYSTEM_CLOCK
+        self.spin_window, self.late_tolerance = spin_window, late_tolerance
+        self.start_t, self.end_t = None, None
+        self.frame_index, self.finished = 0, False
+        self.missed_deadlines, self.worst_lateness = 0, 0.0
+
+    def start(self, start_t=None, duration=None):
+        self.start_t = self.clock.now() if start_t is None else start_t
+        self.end_t = None if duration is None else self.start_t + duration
+        self.frame_index, self.finished = 0, False
+        self.missed_deadlines, self.worst_lateness = 0, 0.0
+
+    def wait_until(self, deadline, handle_event=None):
+        """ Blocks on the event queue, then spins the last spin_window. False if handle_event aborts. """
+        return wait_for_events(deadline, handle_event, self.spin_window, self.clock) is None
+
+    def deadline(self, k):
+        c, i = divmod(k, self.n_holds)
+        return self.start_t + c * self.cycle + self.offsets[i]
+
+    def frame_at(self, t):
+        """ Index of the frame whose slot contains time t. """
+        c, rem = divmod(t - self.start_t, self.cycle)
+        return int(c) * self.n_holds + bisect.bisect_right(self.offsets, rem) - 1
+
+    def _note_miss(self, lateness, frames=1):
+        self.missed_deadlines += frames
+        self.worst_lateness = max(self.worst_lateness, lateness)
+
+    def wait_next(self, handle_event=None):
+        """ Blocks until the next frame is due and returns its index (onset is frame 0).
+        Returns None when end_t is reached (finished=True) or when handle_event aborts (finished=False). """
+        k = self.frame_index + 1
+        deadline = self.deadline(k)
+        now = self.clock.now()
+        if now > deadline + self.late_tolerance and self.miss_policy == self.MISS_SKIP:
+            # Drop every frame whose slot has already passed and present the next one on time
+            k_next = self.frame_at(now) + 1
+            self._note_miss(now - deadline, k_next - k)
+            k, deadline = k_next, self.deadline(k_next)
+        if self.end_t is not None and max(deadline, now) >= self.end_t: # late frames never extend the stimulus
+            if not self.wait_until(self.end_t, handle_event): return None
+            self.finished = True
+            return None
+        if not self.wait_until(deadline, handle_event): return None
+        lateness = self.clock.now() - deadline
+        if lateness > self.late_tolerance: self._note_miss(lateness)
+        self.frame_index = k
+        return k
+
+    def report(self, label):
+        if self.missed_deadlines:
+            log(f"{label}: {self.missed_deadlines} missed frame deadline(s) (policy '{self.miss_policy}'), "
+                  f"worst {self.worst_lateness*1000:.1f} ms late.")
+
+class FlipTelemetry:
+    """ Per-trial flip log in preallocated NumPy arrays; record() only writes scalars so the hot loop never allocates. """
+    def __init__(self, capacity):
+        self.flip_t = np.zeros(capacity, dtype=np.float64)
+        self.deadline_t = np.zeros(capacity, dtype=np.float64)
+        self.frame = np.zeros(capacity, dtype=np.int32)
+        self.board = np.zeros(capacity, dtype=np.uint8)
+        self.count, self.overflow = 0, 0
+        self.frame_period, self.missed_deadlines = None, 0
+
+    @staticmethod
+    def capacity_for(duration, holds, frame_plan=None):
+        if frame_plan: return frame_plan['stim_frames'] + 1
+        return int(np.ceil(duration * len(holds) / sum(holds))) + 16
+
+    def begin(self, frame_period=None):
+        """ Resets for a new trial. frame_period is set in refresh-locked mode, where drops show up as long intervals;
+        in timed mode the FrameScheduler's missed-deadline count is stored in missed_deadlines after the trial. """
+        self.count, self.overflow = 0, 0
+        self.frame_period, self.missed_deadlines = frame_period, 0
+
+    def record(self, flip_t, deadline_t, frame, board):
+        i = self.count
+        if i >= len(self.flip_t): self.overflow += 1; return
+        self.flip_t[i] = flip_t; self.deadline_t[i] = deadline_t
+        self.frame[i] = frame; self.board[i] = board
+        self.count = i + 1
+
+    def summary(self):
+        """ Mean achieved cycle Hz (the flicker rate for two boards), worst frame-change interval error (ms)
+        and dropped flips. board holds the 1-based position in the frame cycle. """
+        n = self.count
+        if n == 0: return {'mean_achieved_hz': 0.0, 'max_interval_error_ms': 0.0, 'dropped_flips': 0}
+        flip_t, deadline_t, board = self.flip_t[:n], self.deadline_t[:n], self.board[:n]
+        changes = np.concatenate(([0], np.flatnonzero(board[1:] != board[:-1]) + 1))
+        mean_hz, max_err_ms = 0.0, 0.0
+        if len(changes) > 1:
+            actual = np.diff(flip_t[changes])
+            max_err_ms = float(np.abs(actual - np.diff(deadline_t[changes])).max()) * 1000.0
+            cycle_starts = flip_t[changes[board[changes] == 1]]
+            if len(cycle_starts) > 1: mean_hz = (len(cycle_starts) - 1) / float(cycle_starts[-1] - cycle_starts[0])
+        if self.frame_period:
+            intervals = np.diff(flip_t)
+            dropped = int(np.clip(np.rint(intervals / self.frame_period) - 1, 0, None).sum())
+        else:
+            dropped = self.missed_deadlines
+        return {'mean_achieved_hz': mean_hz, 'max_interval_error_ms': max_err_ms, 'dropped_flips': dropped + self.overflow}
+
+    def snapshot(self):
+        """ Copies of the recorded flips (times relative to onset) that stay valid once the next trial reuses the buffers. """
+        n = self.count
+        onset = self.flip_t[0] if n else 0.0
+        return dict(flip_s=self.flip_t[:n] - onset, deadline_s=self.deadline_t[:n] - onset,
+                    frame=self.frame[:n].copy(), board=self.board[:n].copy(), overflow=self.overflow)
+
+    def save(self, path, **meta): np.savez_compressed(path, **self.snapshot(), **meta)
+
+def measure_refresh_rate(screen, n_frames=VSYNC_MEASURE_FRAMES):
+    """ Flips blank frames and returns the median refresh rate in Hz, or None if flips don't block on vsync. """
+    display = as_display(screen)
+    display.surface.fill(BLACK); display.flip()
+    stamps = []
+    for _ in range(n_frames + 1):
+        display.flip(); stamps.append(time.perf_counter())
+    period = float(np.median(np.diff(stamps)))
+    return 1.0 / period if period >= VSYNC_MIN_PERIOD_S else None
+
+def plan_refresh_locked_trial(duration, holds, refresh_hz):
+    """ Expresses a trial's duration and each frame's hold time as whole display frames.
+    achieved_hz is the resulting cycle rate (the flicker rate for the classic two-board cycle). """
+    stim_frames = max(1, int(round(duration * refresh_hz)))
+    if len(holds) == 1:
+        return {'stim_frames': stim_frames, 'hold_frames': (stim_frames,), 'achieved_hz': 0.0, 'exact': True,
+                'refresh_hz': refresh_hz}
+    hold_frames = tuple(max(1, int(round(h * refresh_hz))) for h in holds)
+    exact = all(abs(hf - h * refresh_hz) <= VSYNC_HZ_TOLERANCE * h * refresh_hz for hf, h in zip(hold_frames, holds))
+    return {'stim_frames': stim_frames, 'hold_frames': hold_frames, 'achieved_hz': refresh_hz / sum(hold_frames),
+            'exact': exact, 'refresh_hz': refresh_hz}
+
+def open_stimulus_display(presentation_mode, strict=False, renderer_backend=RENDERER_SURFACE):
+    """ Opens the fullscreen display backend. Returns (display, presentation_mode, refresh_hz); vsync falls back to timed. """
+    s_w, s_h = pygame.display.get_desktop_sizes()[0]
+    if renderer_backend == RENDERER_SDL2:
+        vsync = presentation_mode == PRESENTATION_VSYNC
+        display = Sdl2TextureDisplay((s_w, s_h), vsync=vsync)
+        if not vsync: return display, PRESENTATION_TIMED, None
+        refresh_hz = measure_refresh_rate(display)
+        if refresh_hz: log(f"Vsync presentation at measured {refresh_hz:.3f} Hz refresh."); return display, PRESENTATION_VSYNC, refresh_hz
+        display.close()
+        reason = "renderer presents do not block on vsync"
+        if strict: raise pygame.error(f"Vsync presentation unavailable: {reason}")
+        log(f"Vsync presentation unavailable ({reason}); using timed presentation.")
+        return Sdl2TextureDisplay((s_w, s_h)), PRESENTATION_TIMED, None
+
+    if presentation_mode == PRESENTATION_VSYNC:
+        try:
+            display = SurfaceDisplay(pygame.display.set_mode((s_w, s_h), pygame.FULLSCREEN | pygame.SCALED, vsync=1))
+            refresh_hz = measure_refresh_rate(display)
+            if refresh_hz: log(f"Vsync presentation at measured {refresh_hz:.3f} Hz refresh."); return display, PRESENTATION_VSYNC, refresh_hz
+            reason = "display flips do not block on vsync"
+        except pygame.error as e: reason = str(e)
+        if strict: raise pygame.error(f"Vsync presentation unavailable: {reason}")
+        log(f"Vsync presentation unavailable ({reason}); using timed presentation.")
+    flags = pygame.FULLSCREEN | pygame.HWSURFACE | pygame.DOUBLEBUF
+    try: screen = pygame.display.set_mode((s_w, s_h), flags)
+    except pygame.error: flags = pygame.FULLSCREEN | pygame.DOUBLEBUF; screen = pygame.display.set_mode((s_w, s_h), flags)
+    return SurfaceDisplay(screen), PRESENTATION_TIMED, None
+
+def parse_frame_sequence(text, base_dir=None):
+    """ Parses a frame_sequence cell such as '1|2|blank:0.1' into ((source, hold_s or None), ...).
+    Image paths are resolved against base_dir, then the application folder. An empty cell gives None. """
+    text = (text or "").strip()
+    if not text: return None
+    frames = []
+    for token in text.split(FRAME_SEQUENCE_SEPARATOR):
+        token = token.strip()
+        if not token: raise ValueError(f"empty frame in frame_sequence '{text}'")
+        source, hold = token, None
+        if ':' in token:
+            head, tail = token.rsplit(':', 1)
+            tail = tail.strip().lower()
+            try: hold = float(tail[:-2]) / 1000.0 if tail.endswith('ms') else float(tail); source = head.strip()
+            except ValueError: pass # e.g. a Windows drive letter rather than a hold time
+        if hold is not None and hold <= 0: raise ValueError(f"hold time must be positive in '{token}'")
+        if source not in ('1', '2', FRAME_BLANK):
+            candidates = [source] if os.path.isabs(source) else [os.path.join(d, source) for d in (base_dir, APP_BASE_PATH) if d]
+            found = next((c for c in candidates if os.path.isfile(c)), None)
+            if not found: raise ValueError(f"frame image not found: {source}")
+            source = os.path.abspath(found)
+        frames.append((source, hold))
+    return tuple(frames)
+
+def format_frame_sequence(sequence):
+    if not sequence: return ''
+    return FRAME_SEQUENCE_SEPARATOR.join(os.path.basename(src) + (f":{hold:g}" if hold is not None else '') for src, hold in sequence)
+
+def resolve_frame_holds(sequence, hz, duration):
+    """ Per-frame hold times in seconds; a single frame is held for the whole stimulus. """
+    if len(sequence) == 1: return (float(duration),)
+    default = 1.0 / (2.0 * hz) if hz > 0 else None
+    holds = tuple(default if hold is None else hold for _, hold in sequence)
+    if None in holds: raise ValueError("every frame needs a hold time when checkerboard_hz <= 0")
+    return holds
+
+def load_frame_sources(size, sequences, board1, board2, frame_cache=None):
+    """ Maps every source named in the trial frame sequences to a full-screen surface, loaded once per session. """
+    sources = {'1': board1, '2': board2}
+    for src in {src for seq in sequences if seq for src, _ in seq}:
+        if src in sources: continue
+        if src == FRAME_BLANK:
+            sf = pygame.Surface(size)
+            sources[src] = sf.convert() if pygame.display.get_surface() else sf
+        elif frame_cache: sources[src] = frame_cache.load(src, size)
+        else:
+            sf = pygame.image.load(src)
+            sources[src] = pygame.transform.scale(sf.convert() if pygame.display.get_surface() else sf.convert(32), size)
+    return sources
+
+def build_frame_ring(display, sequence, sources, brightness_factor, surface_cache=None):
+    """ Pre-converts and brightness-adjusts every frame of the cycle before onset; presentation then only indexes. """
+    return tuple(display.prepare_board(sources[src], brightness_factor, surface_cache) for src, _ in sequence)
+
+class TrialPrefetcher:
+    """ Builds the next trial's frame ring on a worker thread while the participant is rating the current one.
+    The presentation thread only takes finished rings; anything not ready in time is built synchronously. """
+    def __init__(self, display, sources, surface_cache=None):
+        self.display, self.sources, self.surface_cache = display, sources, surface_cache
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mvast3-prefetch")
+        self.pending = {}
+        self.ready, self.not_ready = 0, 0
+
+    def submit(self, trial_number, sequence, brightness_factor):
+        self.pending[trial_number] = self.executor.submit(build_frame_ring, self.display, sequence, self.sources,
+                                                          brightness_factor, self.surface_cache)
+
+    def take(self, trial_number, sequence, brightness_factor):
+        future = self.pending.pop(trial_number, None)
+        if future is not None and future.done() and future.exception() is None:
+            self.ready += 1
+            return future.result()
+        self.not_ready += 1
+        if future is not None:
+            log(f"Prefetch for trial {trial_number} not ready; preparing synchronously.")
+            # A build already under way is further along than starting over on this thread
+            if not future.cancel() and future.exception() is None: return future.result()
+        return build_frame_ring(self.display, sequence, self.sources, brightness_factor, self.surface_cache)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.pending.clear()
+        log(f"Trial prefetch: {self.ready} ready in time, {self.not_ready} prepared synchronously.")
+
+def run_refresh_locked_stimulus(screen, ring, frame_plan, escape_quits=True, telemetry=None):
+    """ One blocking vsync flip per frame; each ring frame stays up for its hold_frames count. """
+    display = as_display(screen)
+    hold_frames = frame_plan['hold_frames']
+    frame_period = 1.0 / frame_plan['refresh_hz']
+    if telemetry: telemetry.begin(frame_period=frame_period)
+    onset_t = None
+    pos, frames_left = 0, hold_frames[0]
+    for frame in range(frame_plan['stim_frames']):
         for ev in pygame.event.get():
             if ev.type == pygame.QUIT: return False
             if escape_quits and ev.type == pygame.KEYDOWN and ev.key == pygame.K_ESCAPE: return False
-        time.sleep(0.01)
+        display.show_board(ring[pos])
+        if telemetry:
+            flip_t = time.perf_counter()
+            if onset_t is None: onset_t = flip_t
+            telemetry.record(flip_t, onset_t + frame * frame_period, frame, pos + 1)
+        frames_left -= 1
+        if frames_left == 0:
+            pos = (pos + 1) % len(ring); frames_left = hold_frames[pos]
     return True
 
-def run_alternating_stimulus(screen, board1, board2, duration, hz, brightness_factor, escape_quits=True):
+def run_stimulus_cycle(screen, ring, holds, duration, escape_quits=True, miss_policy=FRAME_MISS_POLICY,
+                       frame_plan=None, telemetry=None, clock=None):
+    """ Presents a prepared frame ring for duration seconds, cycling with the given per-frame hold times.
+    Refresh-locked presentation is paced by the display itself and always runs in real time. """
     pygame.mouse.set_visible(False)
-    if hz <= 0: 
-        stim_board = adjust_surface_brightness(board1, brightness_factor) 
-        screen.fill(BLACK); screen.blit(stim_board, (0,0)); pygame.display.flip()
-        start_t = time.perf_counter()
-        while time.perf_counter() - start_t < duration:
-            for ev in pygame.event.get():
-                if ev.type == pygame.QUIT: return False
-                if escape_quits and ev.type == pygame.KEYDOWN and ev.key == pygame.K_ESCAPE: return False
-            time.sleep(0.01)
-        return True
-
-    frame_dur = 1.0 / hz / 2.0 
-    start_t, end_t = time.perf_counter(), time.perf_counter() + duration
-    b_b1 = adjust_surface_brightness(board1, brightness_factor)
-    b_b2 = adjust_surface_brightness(board2, brightness_factor)
-    curr_b1, last_flip_t = True, start_t
+    clock = clock or SYSTEM_CLOCK
+    display = as_display(screen)
+    clock.mark("stimulus", duration=duration)
+    if frame_plan: return run_refresh_locked_stimulus(display, ring, frame_plan, escape_quits, telemetry)
+
+    handle_event = quit_or_escape(escape_quits)
+    n = len(ring)
+    sched = FrameScheduler(holds, miss_policy, clock=clock)
+    if telemetry: telemetry.begin()
+    # Onset: frame 1 goes up immediately; every later deadline is timed from this flip
+    display.show_board(ring[0])
+    sched.start(duration=duration)
+    if telemetry: telemetry.record(sched.start_t, sched.start_t, 0, 1)
     
-    while time.perf_counter() < end_t:
-        for ev in pygame.event.get():
-            if ev.type == pygame.QUIT: return False
-            if escape_quits and ev.type == pygame.KEYDOWN and ev.key == pygame.K_ESCAPE: return False
-        
-        now_t = time.perf_counter()
-        if now_t >= last_flip_t + frame_dur:
-            screen.fill(BLACK)
-            screen.blit(b_b1 if curr_b1 else b_b2, (0,0))
-            pygame.display.flip()
-            curr_b1 = not curr_b1
-            last_flip_t += frame_dur 
-        
-        time_to_next = (last_flip_t + frame_dur) - now_t
-        if time_to_next > 0.002: time.sleep(max(0.001, time_to_next * 0.5)) 
-    return True
+    while True:
+        k = sched.wait_next(handle_event)
+        if k is None: break
+        display.show_board(ring[k % n])
+        if telemetry: telemetry.record(clock.now(), sched.deadline(k), k, k % n + 1)
+    sched.report("Stimulus")
+    if telemetry: telemetry.missed_deadlines = sched.missed_deadlines
+    return sched.finished
+
+def run_alternating_stimulus(screen, board1, board2, duration, hz, brightness_factor, escape_quits=True, surface_cache=None,
+                             miss_policy=FRAME_MISS_POLICY, frame_plan=None, telemetry=None, clock=None):
+    """ Classic two-board flicker (board1 alone when hz <= 0), run as a frame cycle. """
+    display = as_display(screen)
+    sequence = DEFAULT_FRAME_SEQUENCE if hz > 0 else STATIC_FRAME_SEQUENCE
+    ring = build_frame_ring(display, sequence, {'1': board1, '2': board2}, brightness_factor, surface_cache)
+    return run_stimulus_cycle(display, ring, resolve_frame_holds(sequence, hz, duration), duration, escape_quits,
+                              miss_policy, frame_plan, telemetry, clock)
 
 # --- Main Experiment Execution Function ---
-def execute_experiment_run(run_config):
-    screen = None
+def execute_experiment_run(run_config, clock=None):
+    """ Runs a full session. clock paces every wait and records per-phase timings; a VirtualClock with a
+    ScriptedParticipant runs the same session headless (see the simulate command). """
+    screen, clock = None, clock or SystemClock()
     try:
         pygame.init()
         if not pygame.font: pygame.font.init() 
-        s_info = pygame.display.Info()
-        s_w, s_h = s_info.current_w, s_info.current_h
-        flags = pygame.FULLSCREEN | pygame.HWSURFACE | pygame.DOUBLEBUF
-        try: screen = pygame.display.set_mode((s_w, s_h), flags)
-        except pygame.error: flags = pygame.FULLSCREEN | pygame.DOUBLEBUF; screen = pygame.display.set_mode((s_w, s_h), flags)
+        screen, presentation_mode, refresh_hz = open_stimulus_display(run_config.presentation_mode, run_config.vsync_strict,
+                                                                      run_config.renderer_backend)
         
-        actual_w, actual_h = screen.get_size()
+        actual_w, actual_h = screen.surface.get_size()
         pygame.display.set_caption("M-VAST 3 Visual Stimulus"); pygame.mouse.set_visible(False)
-    except pygame.error as e: messagebox.showerror("Pygame Error", f"Pygame init failed: {e}"); return
+    except pygame.error as e: pygame.quit(); messagebox.showerror("Pygame Error", f"Pygame init failed: {e}"); return
 
-    data_h, score_h = None, None
+    data_h, score_h, prefetcher, journal = None, None, None, None
+    catalog, run_status, trials_done = ExperimentCatalog(run_config.catalog_path), "error", 0
+    writer = BackgroundWriter().start() # CSV rows, sidecars, journal records and log lines are written off this thread
+    resume = run_config.resume_state
+    start_idx = len(resume['completed']) if resume else 0
     try:
+        frame_plans = {}
+        if presentation_mode == PRESENTATION_VSYNC:
+            for t in run_config.trials_data:
+                key, holds = (t.stimulus_duration, t.checkerboard_hz, t.cycle), t.holds
+                if key in frame_plans: continue
+                plan = frame_plans[key] = plan_refresh_locked_trial(key[0], holds, refresh_hz)
+                if not plan['exact']:
+                    msg = (f"Frame holds {', '.join(f'{h * 1000:.2f} ms' for h in holds)} are not whole frames at "
+                           f"{refresh_hz:.3f} Hz refresh (nearest achievable cycle: {plan['achieved_hz']:.3f} Hz).")
+                    if run_config.vsync_strict: raise RuntimeError(msg)
+                    log(f"Warning: {msg}")
+        setup_sha1 = catalog.sha1(run_config.master_csv_path)
+        exp_id = catalog.experiment_for_setup(setup_sha1) if setup_sha1 else None
         data_h = ParticipantDataHandler(run_config.log_dir_participant, run_config.participant_id, 
-                                        run_config.master_csv_path, run_config.image1_path, run_config.image2_path)
-        score_h = ParticipantScoreHandler(run_config.log_dir_participant, run_config.participant_id)
-        board1, board2 = load_checkerboard_images(actual_w, actual_h, run_config.image1_path, run_config.image2_path)
+                                        run_config.master_csv_path, *run_config.stimulus_names(),
+                                        presentation_mode, refresh_hz, screen.name, run_config.display_gamma, resume, writer,
+                                        run_config.columnar_export, exp_id, run_config.journal_fsync)
+        score_h = ParticipantScoreHandler(run_config.log_dir_participant, run_config.participant_id, writer)
+        if resume:
+            journal = SessionJournal.resume(resume, data_h.filename, run_config.journal_fsync, writer)
+            for rec in resume['completed']:
+                score_h.add_ratings(rec['discomfort'], rec['brightness'], run_config.trials_data[rec['index']])
+        else:
+            journal = SessionJournal.start(run_config.log_dir_participant, run_config.participant_id, run_config.master_csv_path,
+                                           len(run_config.trials_data), data_h.filename, run_config.journal_fsync, writer)
+        exp_id = data_h.experiment_id # the catalog's, else the one named by the master CSV file
+        if setup_sha1 and not catalog.experiment_for_setup(setup_sha1):
+            catalog.register_setup(exp_id, run_config.master_csv_path, len(run_config.trials_data)) # setup made elsewhere
+        else: catalog.register_experiment(exp_id)
+        catalog.register_run(exp_id, run_config.participant_id, run_config.master_csv_path, setup_sha1, run_config.stimulus_names(),
+                             data_h.filename, journal.path, len(run_config.trials_data))
+        if run_config.stimulus_source == STIMULUS_SOURCE_GENERATED:
+            check_px = check_size_to_px(run_config.check_size, run_config.check_units, actual_w,
+                                        run_config.screen_width_cm, run_config.viewing_distance_cm)
+            board1, board2 = generate_checkerboard_pair((actual_w, actual_h), check_px, run_config.checker_colors, run_config.checker_layout)
+        else:
+            board1, board2 = load_checkerboard_images(actual_w, actual_h, run_config.image1_path, run_config.image2_path,
+                                                      ScaledFrameCache() if run_config.use_frame_cache else None)
         if not (board1 and board2): raise RuntimeError("Failed to load stimulus images.")
+        frame_sources = load_frame_sources((actual_w, actual_h), [t.frame_sequence for t in run_config.trials_data],
+                                           board1, board2, ScaledFrameCache() if run_config.use_frame_cache else None)
+        if run_config.use_indexed_color and screen.name == RENDERER_SURFACE:
+            frame_sources = dict(zip(frame_sources, palettize_surfaces(list(frame_sources.values()))))
+        telemetry = FlipTelemetry(max(FlipTelemetry.capacity_for(t.stimulus_duration, t.holds,
+                                                                  frame_plans.get((t.stimulus_duration, t.checkerboard_hz, t.cycle)))
+                                      for t in run_config.trials_data))
+        trajectories = (RatingTrajectory("unpleasantness"), RatingTrajectory("brightness"))
+        screen.engine = BrightnessEngine(run_config.display_gamma)
+        stim_cache = BrightnessSurfaceCache(engine=screen.engine)
+        screen.prepare_session(tuple(frame_sources.values()), run_config.trials_data.array['brightness_factor'].tolist(), stim_cache)
+        if screen.background_prepare:
+            prefetcher = TrialPrefetcher(screen, frame_sources, stim_cache)
+            first = run_config.trials_data[start_idx]
+            prefetcher.submit(first.trial_number, first.cycle, first.brightness_factor)
 
         num_trials = len(run_config.trials_data)
         
@@ -1461,42 +3180,134 @@ Press the ESC key at any time to stop the experiment.
 
 
 Press any key to begin..."""
-        if not show_message(screen, instructions): raise KeyboardInterrupt("Quit: instructions.")
-
-        for idx, params in enumerate(run_config.trials_data):
-            trial_num, block, t_in_block = params['trial_number'], params['block_number'], params['trial_in_block']
-            bf, sd, fd, hz = params['brightness_factor'], params['stimulus_duration'], params['fixation_duration'], params['checkerboard_hz']
-            if not show_fixation(screen, fd): raise KeyboardInterrupt("Quit: fixation")
-            if not run_alternating_stimulus(screen, board1, board2, sd, hz, bf): raise KeyboardInterrupt("Quit: stimulus")
+        if resume:
+            instructions = (f"Welcome back, Participant {run_config.participant_id}.\n\nThe session continues at trial "
+                            f"{start_idx + 1} of {num_trials}.\n\n" + instructions.split("\n\n", 1)[1].replace("begin", "continue"))
+        if not show_message(screen, instructions, clock=clock): raise KeyboardInterrupt("Quit: instructions.")
+
+        for idx, params in enumerate(run_config.trials_data[start_idx:], start_idx):
+            clock.mark("trial_setup", trial=params)
+            trial_num, bf, sd = params.trial_number, params.brightness_factor, params.stimulus_duration
+            fd, hz, seq, holds = params.fixation_duration, params.checkerboard_hz, params.cycle, params.holds
+            frame_plan = frame_plans.get((sd, hz, seq))
+            ring = (prefetcher.take(trial_num, seq, bf) if prefetcher
+                    else build_frame_ring(screen, seq, frame_sources, bf, stim_cache))
+            if not show_fixation(screen, fd, clock=clock): raise KeyboardInterrupt("Quit: fixation")
+            if not run_stimulus_cycle(screen, ring, holds, sd, miss_policy=run_config.frame_miss_policy,
+                                      frame_plan=frame_plan, telemetry=telemetry, clock=clock): raise KeyboardInterrupt("Quit: stimulus")
+            if prefetcher and idx + 1 < num_trials:
+                nxt = run_config.trials_data[idx + 1] # built while the participant rates this trial
+                prefetcher.submit(nxt.trial_number, nxt.cycle, nxt.brightness_factor)
             
-            discomfort = get_rating_with_click(screen, "", "unpleasantness")
+            discomfort = get_rating_with_click(screen, "", "unpleasantness", trajectories[0], clock)
             if discomfort is None: raise KeyboardInterrupt("Quit: discomfort rating")
             
-            brightness_rating = get_rating_with_click(screen, "", "brightness") 
+            brightness_rating = get_rating_with_click(screen, "", "brightness", trajectories[1], clock)
             if brightness_rating is None: raise KeyboardInterrupt("Quit: brightness rating") 
             
-            data_h.save_trial_response(params, discomfort, brightness_rating)
-            score_h.add_ratings(discomfort, brightness_rating)
-
-        print("\n===== All Trials Complete =====") 
-        show_message(screen, "Experiment complete. Thank you!\nWindow will close shortly.", wait_for_key=False)
-        pygame.time.wait(4000)
+            clock.mark("save") # still on the rating screen; the next fixation has not started
+            # the CSV row is queued (and synced) first, so the journal never lists a trial the data file lacks
+            data_h.save_trial_response(params, discomfort, brightness_rating, frame_plan, telemetry, trajectories)
+            journal.record_trial(idx, params, discomfort, brightness_rating)
+            trials_done = idx + 1
+            score_h.add_ratings(discomfort, brightness_rating, params)
+
+        run_status = "complete"
+        log("\n===== All Trials Complete =====") 
+        show_message(screen, "Experiment complete. Thank you!\nWindow will close shortly.", wait_for_key=False, clock=clock)
+        clock.sleep(4.0)
     except KeyboardInterrupt as ki: 
-        if screen: show_message(screen, "Experiment stopped.", wait_for_key=False); pygame.time.wait(2000)
-        print(f"\n--- User Terminated ({ki}) ---")
+        if screen: show_message(screen, "Experiment stopped.", wait_for_key=False, clock=clock); clock.sleep(2.0)
+        log(f"\n--- User Terminated ({ki}) ---"); run_status = "stopped"
     except (RuntimeError, IOError, pygame.error) as e: 
-        if screen: show_message(screen, f"Error:\n{e}\nStopped.", wait_for_key=False); pygame.time.wait(5000)
-        print(f"\n--- Halted (Error): {e} ---")
+        if screen: show_message(screen, f"Error:\n{e}\nStopped.", wait_for_key=False, clock=clock); clock.sleep(5.0)
+        log(f"\n--- Halted (Error): {e} ---")
     except Exception as e:
-        if screen: show_message(screen, f"Unexpected error:\n{type(e).__name__}\nStopped.", wait_for_key=False); pygame.time.wait(5000)
-        print(f"\n--- Unexpected Error: {type(e).__name__}: {e} ---"); import traceback; traceback.print_exc()
+        if screen: show_message(screen, f"Unexpected error:\n{type(e).__name__}\nStopped.", wait_for_key=False, clock=clock); clock.sleep(5.0)
+        log(f"\n--- Unexpected Error: {type(e).__name__}: {e} ---"); import traceback; log(traceback.format_exc())
     finally:
-        print("\n--- Cleaning Up ---")
-        if score_h: score_h.save_final_scores()
-        if data_h: data_h.close()
-        if pygame.get_init(): pygame.quit(); print("Pygame closed.")
+        try:
+            log("\n--- Cleaning Up ---")
+            clock.mark(None); clock.print_phase_report()
+            if prefetcher: prefetcher.close()
+            if data_h: data_h.close() # synced before the journal records how the session ended
+            if journal: journal.close('complete' if run_status == "complete" else 'stopped')
+            if score_h: score_h.save_final_scores()
+            if data_h: writer.submit(catalog.finish_run, data_h.filename, run_status, trials_done)
+            if screen: screen.engine.report(); screen.close()
+            TEXT_CACHE.report(); TEXT_CACHE.clear()
+            if pygame.get_init(): pygame.quit(); log("Pygame closed.")
+        finally:
+            writer.close(); writer.report() # every queued row, sidecar and journal record is on disk past this point
+
+# --- Command-Line Tools ---
+def parse_size(text):
+    try: w, h = (int(v) for v in text.lower().split('x')); return w, h
+    except ValueError: raise argparse.ArgumentTypeError(f"Expected WIDTHxHEIGHT, got '{text}'")
+
+def run_command_line(argv):
+    parser = argparse.ArgumentParser(prog="mvast3.py", description="M-VAST 3 command-line tools (run without arguments for the GUI).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm = sub.add_parser("warm-cache", help="Pre-scale stimulus images into the on-disk frame cache for a display size.")
+    warm.add_argument("images", nargs="*", help="Image files (default: every stimulus in images/).")
+    warm.add_argument("--size", type=parse_size, help="Target display size, e.g. 3840x2160 (default: current desktop).")
+    warm.add_argument("--cache-dir", default=FRAME_CACHE_DIR)
+    sim = sub.add_parser("simulate", help="Run a whole session headless on a virtual clock with a scripted participant.")
+    sim.add_argument("master_csv", help="Master trial CSV (as made by the setup generator).")
+    sim.add_argument("--participant", default="SIM", help="Participant ID written to the output files (default: SIM).")
+    sim.add_argument("--log-dir", default=DEFAULT_LOG_DIR_PARTICIPANT)
+    sim.add_argument("--images", nargs=2, metavar=("IMAGE1", "IMAGE2"), help="Stimulus pair (default: images/checker_bw*.png).")
+    sim.add_argument("--seed", type=int, default=None, help="Seed for the participant's ratings and reaction times.")
+    sim.add_argument("--resume", action="store_true", help="Continue this participant's unfinished session, if there is one.")
+    sim.add_argument("--catalog", default=CATALOG_PATH, help="Experiment catalog to register the run in.")
+    cat = sub.add_parser("catalog", help="List runs recorded in the experiment catalog.")
+    cat.add_argument("--experiment", help="Only runs of this experiment ID.")
+    cat.add_argument("--participant", help="Only runs of this participant.")
+    cat.add_argument("--catalog", default=CATALOG_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "warm-cache":
+        pygame.init()
+        size = args.size or pygame.display.get_desktop_sizes()[0]
+        images = args.images or sorted(p for p in glob.glob(os.path.join(resource_path("images"), "*.png"))
+                                       if os.path.basename(p) != "mvast_3.png")
+        cache = warm_frame_cache(size, images, ScaledFrameCache(args.cache_dir))
+        print(f"Frame cache at {cache.cache_dir}: {cache.hits} already cached, {cache.misses} added.")
+        pygame.quit()
+    elif args.command == "simulate":
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        config = RunConfig()
+        config.master_csv_path, config.participant_id, config.log_dir_participant = args.master_csv, args.participant, args.log_dir
+        config.image1_path, config.image2_path = args.images or [resource_path(os.path.join("images", n))
+                                                                 for n in ("checker_bw.png", "checker_bw_.png")]
+        config.catalog_path = args.catalog
+        try: config.trials_data = load_trial_plan(args.master_csv)
+        except (ValueError, OSError) as e: print(f"Cannot read {args.master_csv}: {e}"); return 1
+        os.makedirs(config.log_dir_participant, exist_ok=True)
+        if args.resume:
+            config.resume_state = SessionJournal.find_unfinished(config.log_dir_participant, args.participant, args.master_csv,
+                                                                 len(config.trials_data), ExperimentCatalog(config.catalog_path))
+            print(f"Resuming after trial {len(config.resume_state['completed'])}." if config.resume_state else "No unfinished session to resume.")
+        clock, wall_start = VirtualClock(ScriptedParticipant(args.seed)), time.perf_counter()
+        execute_experiment_run(config, clock)
+        report = {'participant_id': args.participant, 'master_csv': os.path.abspath(args.master_csv), 'seed': args.seed,
+                  'trials': len(config.trials_data), 'session_s': round(clock.now(), 3),
+                  'wall_s': round(time.perf_counter() - wall_start, 3), 'phases': clock.phase_report()}
+        fn = os.path.join(config.log_dir_participant,
+                          f"simulation_P{args.participant}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with open(fn, 'w') as f: json.dump(report, f, indent=2)
+        print(f"Simulated {report['session_s']:.1f} s session in {report['wall_s']:.1f} s; phase timings saved to: {fn}")
+    elif args.command == "catalog":
+        if not os.path.exists(args.catalog): print(f"No catalog at {args.catalog}"); return 1
+        runs = ExperimentCatalog(args.catalog).runs(args.experiment, args.participant)
+        for r in runs:
+            print(f"{r['started'] or '':<20} {r['exp_id'] or '?':<16} {r['participant_id']:<12} {r['status'] or '':<9} "
+                  f"{r['trials_completed'] or 0:>3}/{r['trials_total'] or 0:<3} {r['station'] or '':<12} {os.path.basename(r['data_file'] or '')}")
+        print(f"{len(runs)} run(s).")
+    return 0
 
 # --- Main Application Entry Point ---
 if __name__ == '__main__':
+    if len(sys.argv) > 1: sys.exit(run_command_line(sys.argv[1:]))
     app = MVAST3Application()
     app.run()
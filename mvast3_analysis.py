@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+M-VAST 3 cohort psychometric fits: rating vs. brightness factor per participant, for every participant at once
+
+    python mvast3_analysis.py fit experiment_data/cohort/cohort_trials.npz --output fits.csv
+    python mvast3_analysis.py fit experiment_data/participant_runs --models linear,power --bootstrap 2000 --seed 1
+"""
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import sys
+import csv
+import glob
+import time
+import argparse
+import warnings
+
+import numpy as np
+import mvast3
+
+# --- Analysis Constants ---
+SCALE_COLUMNS = {"Discomfort": "Discomfort_Rating_0_100", "Brightness": "Brightness_Rating_0_100"}
+DEFAULT_BOOTSTRAP = 1000
+BOOTSTRAP_CHUNK_CELLS = 4_000_000 # resamples x participants x trials gathered per chunk (~32 MB per float array)
+CI_LEVEL = 0.95
+RATING_MAX = 100.0
+LOGISTIC_EPS = 0.5 / RATING_MAX # ratings of 0 and 100 are pulled in by half a point before the logit
+SESSION_EXPORT_GLOBS = ("data_P*_trials.npz", "data_P*_trials.parquet")
+
+# --- Models ---
+def logit(p):
+    p = np.clip(p, LOGISTIC_EPS, 1 - LOGISTIC_EPS)
+    return np.log(p / (1 - p))
+
+# Every model is fitted as a straight line v = c + m*u on transformed data, so all participants (and all bootstrap
+# resamples) are solved together from masked sums. transform(x, y) -> (u, v, usable); params(c, m) -> model parameters.
+MODELS = {
+    "linear": {'params': ("intercept", "slope"),
+               'transform': lambda x, y: (x, y, np.ones(np.broadcast(x, y).shape, dtype=bool)),
+               'from_line': lambda c, m: (c, m),
+               'predict': lambda p, x: p[0] + p[1] * x},
+    "power": {'params': ("scale", "exponent"), # y = a * x^b, fitted in log-log space; zero ratings are left out
+              'transform': lambda x, y: (np.log(np.where(x > 0, x, 1.0)), np.log(np.where(y > 0, y, 1.0)), (x > 0) & (y > 0)),
+              'from_line': lambda c, m: (np.exp(c), m),
+              'predict': lambda p, x: p[0] * np.power(np.maximum(x, 0.0), p[1])},
+    "logistic": {'params': ("midpoint", "steepness"), # y = 100 / (1 + exp(-k (x - x0))), fitted on logit(y / 100)
+                 'transform': lambda x, y: (x, logit(y / RATING_MAX), np.ones(np.broadcast(x, y).shape, dtype=bool)),
+                 'from_line': lambda c, m: (-c / m, m),
+                 'predict': lambda p, x: RATING_MAX / (1.0 + np.exp(-p[1] * (x - p[0])))},
+}
+
+def batched_line_fit(u, v, w):
+    """ Weighted least-squares line over the last axis for every leading index at once. Returns (intercept, slope);
+    NaN where fewer than two points are usable or u does not vary. """
+    n, su, sv = w.sum(-1), (w * u).sum(-1), (w * v).sum(-1)
+    suu, suv = (w * u * u).sum(-1), (w * u * v).sum(-1)
+    den = n * suu - su * su
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ok = (n >= 2) & (den > 1e-12 * np.maximum(n * suu, 1e-300))
+        slope = np.where(ok, (n * suv - su * sv) / np.where(ok, den, 1.0), np.nan)
+        intercept = np.where(ok, (sv - slope * su) / np.where(n > 0, n, 1.0), np.nan)
+    return intercept, slope
+
+def fit_model(model, x, y, w):
+    """ Fits one model to padded (..., trials) arrays; returns (params, r2), with r2 measured on the rating scale. """
+    spec = MODELS[model]
+    u, v, usable = spec['transform'](x, y)
+    wu = w * usable
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        params = spec['from_line'](*batched_line_fit(u, v, wu))
+        pred = spec['predict'](tuple(p[..., None] for p in params), x)
+        n = w.sum(-1)
+        mean = (w * y).sum(-1) / np.where(n > 0, n, 1.0)
+        sse, sst = (w * (y - pred) ** 2).sum(-1), (w * (y - mean[..., None]) ** 2).sum(-1)
+        r2 = np.where(sst > 0, 1.0 - sse / np.where(sst > 0, sst, 1.0), np.nan)
+    return params, r2
+
+# --- Data ---
+def pack_by_participant(participants, x, y):
+    """ Scatters trials into left-aligned (participant, trial) arrays. Returns ids, X, Y, W (1 = real trial), counts. """
+    ids, inv, counts = np.unique(participants, return_inverse=True, return_counts=True)
+    order = np.argsort(inv, kind='stable')
+    inv_sorted = inv[order]
+    pos = np.arange(len(order)) - np.concatenate(([0], np.cumsum(counts)[:-1]))[inv_sorted]
+    shape = (len(ids), int(counts.max()) if len(counts) else 0)
+    X, Y, W = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    X[inv_sorted, pos], Y[inv_sorted, pos], W[inv_sorted, pos] = x[order], y[order], 1.0
+    return ids, X, Y, W, counts
+
+def bootstrap_fits(model, X, Y, counts, n_boot, rng):
+    """ Refits every participant on n_boot resamples of their own trials (drawn with replacement), in chunks sized by
+    BOOTSTRAP_CHUNK_CELLS. Returns one (n_boot, participants) array per parameter. """
+    P, N = X.shape
+    rows = np.arange(P)[None, :, None]
+    valid = (np.arange(N)[None, :] < counts[:, None]).astype(np.float64)[None]
+    chunk = max(1, BOOTSTRAP_CHUNK_CELLS // max(1, P * N))
+    out = [np.empty((n_boot, P)) for _ in MODELS[model]['params']]
+    for start in range(0, n_boot, chunk):
+        b = min(chunk, n_boot - start)
+        idx = (rng.random((b, P, N)) * counts[None, :, None]).astype(np.intp)
+        params, _ = fit_model(model, X[rows, idx], Y[rows, idx], np.broadcast_to(valid, (b, P, N)))
+        for o, p in zip(out, params): o[start:start + b] = p
+    return out
+
+def load_trials(inputs, include_aborted=False):
+    """ Concatenates trial tables from cohort files (mvast3_cohort.py), session exports (data_P*_trials.*) or folders
+    searched for session exports. Aborted sessions are left out unless include_aborted. """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths += sorted(p for pattern in SESSION_EXPORT_GLOBS for p in glob.glob(os.path.join(item, "**", pattern), recursive=True))
+        else: paths.append(item)
+    keep = ['Participant_ID', 'Brightness_Factor'] + list(SCALE_COLUMNS.values())
+    tables = []
+    for path in paths:
+        cols, _ = mvast3.load_session_columns(path)
+        mask = np.ones(len(cols['Participant_ID']), dtype=bool)
+        if not include_aborted and 'Session_Status' in cols: mask &= cols['Session_Status'] != "aborted"
+        tables.append({k: cols[k][mask] for k in keep})
+    if not tables: return None, 0
+    return {k: np.concatenate([t[k] for t in tables]) for k in keep}, len(paths)
+
+# --- Fitting and Export ---
+def fit_cohort(trials, models, n_boot, seed=None, ci_level=CI_LEVEL):
+    """ Returns long-format rows: one per participant, scale, model and parameter, with its bootstrap CI. """
+    rng = np.random.default_rng(seed)
+    lo_q, hi_q = 50 * (1 - ci_level), 50 * (1 + ci_level)
+    rows = []
+    for scale, column in SCALE_COLUMNS.items():
+        x, y = trials['Brightness_Factor'].astype(np.float64), trials[column].astype(np.float64)
+        ok = np.isfinite(x) & np.isfinite(y) & (y >= 0) # -1 marks a missing rating
+        ids, X, Y, W, counts = pack_by_participant(trials['Participant_ID'][ok], x[ok], y[ok])
+        if not len(ids): continue
+        for model in models:
+            params, r2 = fit_model(model, X, Y, W)
+            boots = bootstrap_fits(model, X, Y, counts, n_boot, rng) if n_boot else [np.full((1, len(ids)), np.nan)] * len(params)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning) # all-NaN columns (unfittable participants) give NaN bounds
+                bounds = [np.nanpercentile(b, [lo_q, hi_q], axis=0) for b in boots]
+            for name, est, (lo, hi) in zip(MODELS[model]['params'], params, bounds):
+                rows += [[pid, scale, model, name, est[i], lo[i], hi[i], r2[i], int(counts[i])] for i, pid in enumerate(ids)]
+    return rows
+
+FIT_COLUMNS = ('Participant_ID', 'Scale', 'Model', 'Parameter', 'Estimate', 'CI_Low', 'CI_High', 'R2', 'N_Trials')
+
+def export_fits(rows, output, meta):
+    """ Writes the fits as CSV and as a columnar file (Parquet or .npz) next to it. """
+    fmt = lambda v: '' if isinstance(v, float) and not np.isfinite(v) else (f"{v:.6g}" if isinstance(v, float) else v)
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f); w.writerow(FIT_COLUMNS); w.writerows([[fmt(v) for v in r] for r in rows])
+    cols = {name: np.array([r[i] for r in rows], dtype=float if name in ('Estimate', 'CI_Low', 'CI_High', 'R2') else
+                           int if name == 'N_Trials' else str) for i, name in enumerate(FIT_COLUMNS)}
+    return mvast3.write_columns(os.path.splitext(output)[0], cols, meta)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="mvast3_analysis.py", description="Per-participant psychometric fits for a cohort.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fit = sub.add_parser("fit", help="Fit rating vs. brightness models for every participant, with bootstrap CIs.")
+    fit.add_argument("inputs", nargs="+", help="cohort_trials / data_P*_trials files, or folders of session exports.")
+    fit.add_argument("--models", default=",".join(MODELS), help=f"Comma-separated subset of {', '.join(MODELS)}")
+    fit.add_argument("--bootstrap", type=int, default=DEFAULT_BOOTSTRAP, help="Resamples per participant (0: no CIs).")
+    fit.add_argument("--ci", type=float, default=CI_LEVEL)
+    fit.add_argument("--seed", type=int, default=None)
+    fit.add_argument("--include-aborted", action="store_true", help="Also use trials from aborted sessions.")
+    fit.add_argument("--output", default="mvast3_fits.csv")
+    args = parser.parse_args(argv)
+
+    models = [m.strip() for m in args.models.split(",")]
+    unknown = [m for m in models if m not in MODELS]
+    if unknown: parser.error(f"unknown model: {', '.join(unknown)}")
+    t0 = time.perf_counter()
+    trials, n_files = load_trials(args.inputs, args.include_aborted)
+    if trials is None: print("No trial data found."); return 1
+    rows = fit_cohort(trials, models, max(0, args.bootstrap), args.seed, args.ci)
+    meta = {'inputs': [os.path.abspath(p) for p in args.inputs], 'models': models, 'bootstrap': args.bootstrap,
+            'ci_level': args.ci, 'seed': args.seed}
+    columnar = export_fits(rows, args.output, meta)
+    n_participants = len(np.unique(trials['Participant_ID']))
+    print(f"{n_participants} participant(s), {len(trials['Participant_ID'])} trials from {n_files} file(s) fitted in "
+          f"{time.perf_counter() - t0:.1f} s; wrote {args.output} and {columnar}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
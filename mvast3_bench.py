@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+M-VAST 3 stimulus hot-path microbenchmarks (headless, SDL dummy video driver)
+
+    python mvast3_bench.py run --output bench_before.json
+    python mvast3_bench.py run --sizes 1080p,4k --repeat 10 --output bench_after.json
+    python mvast3_bench.py compare bench_before.json bench_after.json
+"""
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # must be set before pygame initialises video
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import sys
+import io
+import json
+import time
+import glob
+import platform
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime
+
+import numpy as np
+import pygame
+import mvast3
+
+# --- Benchmark Constants ---
+RESOLUTIONS = {"1080p": (1920, 1080), "1440p": (2560, 1440), "4k": (3840, 2160), "8k": (7680, 4320)}
+DEFAULT_REPEAT = 5
+BENCH_BRIGHTNESS_FACTOR = 0.55
+STIMULUS_LOOP_DURATION_S = 0.3
+STIMULUS_LOOP_HZ = 1000.0 # far above any real rate, so the loop runs flat out and measures per-flip cost
+REGRESSION_THRESHOLD = 0.10 # flag cases whose median got more than 10% slower...
+REGRESSION_MIN_DELTA_MS = 0.05 # ...and by more than this, so sub-50 us jitter is not reported
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+
+# --- Timing Helpers ---
+def time_call(fn, repeat, setup=None):
+    """ Runs setup() (untimed) then fn() repeat times; returns summary statistics in milliseconds. """
+    samples = []
+    for _ in range(repeat):
+        if setup: setup()
+        t0 = time.perf_counter(); fn(); samples.append((time.perf_counter() - t0) * 1000.0)
+    return summarize(samples)
+
+def summarize(samples_ms):
+    a = np.asarray(samples_ms, dtype=np.float64)
+    return {'median_ms': float(np.median(a)), 'min_ms': float(a.min()), 'max_ms': float(a.max()), 'n': int(a.size)}
+
+def stimulus_pairs():
+    """ (name, image1, image2) for each shipped phase-reversed pair, e.g. checker_bw.png / checker_bw_.png. """
+    pairs = []
+    for img1 in sorted(glob.glob(os.path.join(IMAGES_DIR, "*check*_*.png"))):
+        img2 = img1[:-4] + "_.png"
+        if not img1.endswith("_.png") and os.path.exists(img2): pairs.append((os.path.basename(img1)[:-4], img1, img2))
+    return pairs
+
+# --- Benchmarks ---
+def bench_brightness(screen, repeat):
+    """ Every brightness engine tier: 32-bit byte-pair LUT, 24-bit LUT, 8-bit (converted) and indexed (palette + conversion). """
+    size = screen.get_size()
+    board1, board2 = mvast3.generate_checkerboard_pair(size, mvast3.DEFAULT_CHECK_SIZE_PX, "by")
+    engine = mvast3.BrightnessEngine()
+    tiers = {'lut16': board1, 'lut8': board1.convert(24), 'lut16-converted': board1.convert(8)}
+    results = {}
+    for tier, src in tiers.items():
+        engine.apply(src, BENCH_BRIGHTNESS_FACTOR) # builds the LUTs once, as a session would
+        results[f"brightness/{tier}"] = time_call(lambda: engine.apply(src, BENCH_BRIGHTNESS_FACTOR), repeat)
+    with contextlib.redirect_stdout(io.StringIO()): indexed = mvast3.palettize_surfaces([board1, board2])[1]
+    results["brightness/indexed-render"] = time_call(lambda: indexed.render(BENCH_BRIGHTNESS_FACTOR, engine),
+                                                     repeat, setup=indexed.scaled.clear)
+    gamma_engine = mvast3.BrightnessEngine(2.2); gamma_engine.apply(board1, BENCH_BRIGHTNESS_FACTOR)
+    results["brightness/lut16-gamma"] = time_call(lambda: gamma_engine.apply(board1, BENCH_BRIGHTNESS_FACTOR), repeat)
+    return results
+
+def bench_checkerboard_generation(screen, repeat):
+    size, results = screen.get_size(), {}
+    for layout in mvast3.CHECKER_LAYOUTS:
+        results[f"generate/{layout}"] = time_call(lambda: mvast3.generate_checkerboard_pair(size, 50, "bw", layout), repeat,
+                                                  setup=mvast3._generate_checkerboard_pair.cache_clear)
+    return results
+
+def bench_image_loading(screen, repeat):
+    """ Shipped stimulus pairs: decode + scale (no cache), a cold frame-cache miss and a warm frame-cache hit. """
+    w, h = screen.get_size()
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = mvast3.ScaledFrameCache(cache_dir)
+        def clear_cache():
+            for fp in glob.glob(os.path.join(cache_dir, "*.raw")): os.remove(fp)
+        for name, img1, img2 in stimulus_pairs():
+            results[f"load/{name}/uncached"] = time_call(lambda: mvast3.load_checkerboard_images(w, h, img1, img2), repeat)
+            results[f"load/{name}/cache-miss"] = time_call(lambda: mvast3.load_checkerboard_images(w, h, img1, img2, cache),
+                                                           repeat, setup=clear_cache)
+            mvast3.load_checkerboard_images(w, h, img1, img2, cache)
+            results[f"load/{name}/cache-hit"] = time_call(lambda: mvast3.load_checkerboard_images(w, h, img1, img2, cache), repeat)
+    return results
+
+def bench_rating_scale(screen, repeat):
+    results = {}
+    def build_and_draw():
+        scale = mvast3.RatingScale(screen, "", scale_type="unpleasantness"); scale.draw()
+    results["rating/full-draw"] = time_call(build_and_draw, repeat, setup=mvast3.TEXT_CACHE.clear)
+    results["rating/full-draw-cached-text"] = time_call(build_and_draw, repeat)
+    scale = mvast3.RatingScale(screen, "", scale_type="unpleasantness"); scale.draw()
+    values = iter(range(10**6))
+    def move_slider(): scale.value = next(values) % 101; scale.redraw()
+    results["rating/redraw"] = time_call(move_slider, repeat)
+    return results
+
+def bench_show_message(screen, repeat):
+    text = "Welcome.\n\nPlease keep your eyes focused on the center of the screen.\n\nPress any key to begin..."
+    return {"message/render": time_call(lambda: mvast3.show_message(screen, text, wait_for_key=False), repeat,
+                                        setup=mvast3.TEXT_CACHE.clear),
+            "message/render-cached-text": time_call(lambda: mvast3.show_message(screen, text, wait_for_key=False), repeat)}
+
+def bench_stimulus_loop(screen, repeat):
+    """ Per-flip cost of run_alternating_stimulus for full-colour and indexed boards (median flip interval). """
+    size = screen.get_size()
+    board1, board2 = mvast3.generate_checkerboard_pair(size, mvast3.DEFAULT_CHECK_SIZE_PX, "bw")
+    with contextlib.redirect_stdout(io.StringIO()): indexed = mvast3.palettize_surfaces([board1, board2])
+    cache = mvast3.BrightnessSurfaceCache()
+    holds = (0.5 / STIMULUS_LOOP_HZ,) * 2
+    telemetry = mvast3.FlipTelemetry(mvast3.FlipTelemetry.capacity_for(STIMULUS_LOOP_DURATION_S, holds))
+    results = {}
+    for tier, (b1, b2) in {'surface': (board1, board2), 'indexed': tuple(indexed)}.items():
+        samples = []
+        for _ in range(repeat):
+            with contextlib.redirect_stdout(io.StringIO()): # the scheduler reports every (expected) missed deadline
+                mvast3.run_alternating_stimulus(screen, b1, b2, STIMULUS_LOOP_DURATION_S, STIMULUS_LOOP_HZ,
+                                                BENCH_BRIGHTNESS_FACTOR, surface_cache=cache,
+                                                miss_policy=mvast3.FrameScheduler.MISS_LATE, telemetry=telemetry)
+            samples.append(float(np.median(np.diff(telemetry.flip_t[:telemetry.count]))) * 1000.0)
+        results[f"stimulus-loop/{tier}"] = summarize(samples)
+    return results
+
+BENCHMARKS = {
+    'brightness': bench_brightness,
+    'generate': bench_checkerboard_generation,
+    'load': bench_image_loading,
+    'rating': bench_rating_scale,
+    'message': bench_show_message,
+    'stimulus-loop': bench_stimulus_loop,
+}
+
+# --- Run / Compare ---
+def run_benchmarks(sizes, repeat, benchmarks):
+    pygame.init()
+    results = {}
+    try:
+        for label in sizes:
+            screen = pygame.display.set_mode(RESOLUTIONS[label])
+            for name in benchmarks:
+                t0 = time.perf_counter()
+                for case, stats in BENCHMARKS[name](screen, repeat).items():
+                    results[f"{label}/{case}"] = stats
+                print(f"{label:>6} {name:<14} done in {time.perf_counter() - t0:.1f} s")
+    finally:
+        mvast3.TEXT_CACHE.clear(); pygame.quit()
+    return {'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'), 'app_version': mvast3.APP_VERSION,
+                     'python': platform.python_version(), 'pygame': pygame.version.ver,
+                     'sdl': ".".join(map(str, pygame.get_sdl_version())), 'numpy': np.__version__,
+                     'platform': platform.platform(), 'processor': platform.processor(), 'repeat': repeat},
+            'results': results}
+
+def compare_results(old, new, threshold=REGRESSION_THRESHOLD, min_delta_ms=REGRESSION_MIN_DELTA_MS):
+    """ Prints old vs new medians for every shared case; returns the names of cases that regressed. """
+    old_r, new_r = old['results'], new['results']
+    regressions = []
+    print(f"{'case':<48} {'old ms':>10} {'new ms':>10} {'change':>8}")
+    for case in sorted(set(old_r) & set(new_r)):
+        a, b = old_r[case]['median_ms'], new_r[case]['median_ms']
+        change = (b - a) / a if a > 0 else 0.0
+        regressed = change > threshold and (b - a) > min_delta_ms
+        if regressed: regressions.append(case)
+        print(f"{case:<48} {a:>10.3f} {b:>10.3f} {change:>+7.1%}{'  REGRESSION' if regressed else ''}")
+    for case in sorted(set(old_r) ^ set(new_r)):
+        print(f"{case:<48} only in {'old' if case in old_r else 'new'} results")
+    if old['meta'].get('platform') != new['meta'].get('platform'):
+        print("Warning: results come from different platforms; differences may not be meaningful.")
+    print(f"{len(regressions)} regression(s) over {threshold:.0%}.")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="mvast3_bench.py", description="M-VAST 3 stimulus hot-path microbenchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_p = sub.add_parser("run", help="Run the benchmarks and write a JSON result file.")
+    run_p.add_argument("--sizes", default=",".join(RESOLUTIONS), help=f"Comma-separated subset of {', '.join(RESOLUTIONS)}")
+    run_p.add_argument("--benchmarks", default=",".join(BENCHMARKS), help=f"Comma-separated subset of {', '.join(BENCHMARKS)}")
+    run_p.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run_p.add_argument("--output", default="mvast3_bench.json")
+    cmp_p = sub.add_parser("compare", help="Compare two result files and flag regressions (exit status 1 if any).")
+    cmp_p.add_argument("old"); cmp_p.add_argument("new")
+    cmp_p.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Relative slowdown to flag (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        sizes, names = [s.strip().lower() for s in args.sizes.split(",")], [b.strip() for b in args.benchmarks.split(",")]
+        unknown = [s for s in sizes if s not in RESOLUTIONS] + [b for b in names if b not in BENCHMARKS]
+        if unknown: parser.error(f"unknown size/benchmark: {', '.join(unknown)}")
+        report = run_benchmarks(sizes, max(1, args.repeat), names)
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+        print(f"{len(report['results'])} results written to {args.output}")
+        return 0
+    with open(args.old) as f: old = json.load(f)
+    with open(args.new) as f: new = json.load(f)
+    return 1 if compare_results(old, new, args.threshold) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
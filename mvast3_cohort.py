@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+M-VAST 3 cohort ingestion: every data_P*.csv and summary_P*_avg_scores_*.csv under a participant_runs folder
+into one typed trial table and one summary table (Parquet with pyarrow, .npz otherwise)
+
+    python mvast3_cohort.py ingest experiment_data/participant_runs --output experiment_data/cohort
+    python mvast3_cohort.py ingest experiment_data/participant_runs --workers 8 --full
+"""
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import sys
+import csv
+import json
+import glob
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import mvast3
+
+# --- Cohort Constants ---
+DEFAULT_RUNS_DIR = mvast3.DEFAULT_LOG_DIR_PARTICIPANT
+DEFAULT_OUTPUT_DIR = os.path.join(mvast3.DEFAULT_LOG_DIR_BASE, "cohort")
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+PARTS_SUBDIR = "parts" # one parsed .npz per source file, named by content hash
+DATA_GLOB, SUMMARY_GLOB, JOURNAL_GLOB = "data_P*.csv", "summary_P*_avg_scores_*.csv", "journal_P*.jsonl"
+SUMMARY_COLUMNS = (('Participant_ID', 'U'), ('Timestamp_Summary', 'U'), ('Number_Of_Rated_Trials', 'i4'),
+                   ('Average_Discomfort', 'f8'), ('Average_Brightness', 'f8'))
+# Session_Status: complete; partial (ended early, e.g. ESC, or an earlier segment of a resumed session);
+# aborted (no end row and never resumed)
+STATUS_COMPLETE, STATUS_PARTIAL, STATUS_ABORTED = "complete", "partial", "aborted"
+
+# --- Parsing (runs in worker processes) ---
+def parse_data_csv(path):
+    """ Splits a data_P*.csv into its preamble, its trial rows (SESSION_COLUMNS order; older files lacking a column get
+    empty cells) and whether the closing Timestamp_End_Run row was written. Rows that are torn or do not convert are
+    counted in bad_rows rather than kept. """
+    meta, rows, ended, bad = {}, [], False, 0
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if not row: break
+            meta[row[0]] = row[1] if len(row) > 1 else ''
+        header = next(reader, None) or []
+        for row in reader:
+            if not row: continue
+            if row[0] == 'Timestamp_End_Run': ended = True; meta['Timestamp_End_Run'] = row[1] if len(row) > 1 else ''; break
+            if len(row) != len(header): bad += 1; continue
+            cells = dict(zip(header, row))
+            ordered = [cells.get(name, '') for name, _ in mvast3.SESSION_COLUMNS]
+            try: mvast3.session_columns_from_rows([ordered])
+            except ValueError: bad += 1; continue
+            rows.append(ordered)
+    return meta, rows, ended, bad
+
+def parse_summary_csv(path):
+    with open(path, 'r', newline='', encoding='utf-8') as f: pairs = {r[0]: r[1] for r in csv.reader(f) if len(r) > 1}
+    convert = {'f8': lambda v: np.float64(v) if v else np.nan, 'i4': lambda v: np.int32(v) if v else np.int32(-1), 'U': str}
+    cols = {name: np.array([convert[kind](pairs.get(name, ''))]) for name, kind in SUMMARY_COLUMNS}
+    return cols, {'Timestamp_Summary': pairs.get('Timestamp_Summary', '')}
+
+def ingest_file(path, kind, parts_dir):
+    """ Parses one source file into parts/<sha1>.npz (skipped when that content was parsed before) and returns its
+    manifest entry. Errors are reported in the entry instead of raised, so one bad file cannot stop the run. """
+    st = os.stat(path)
+    entry = {'kind': kind, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': mvast3.file_sha1(path)}
+    part = os.path.join(parts_dir, entry['sha1'])
+    try:
+        if kind == "data":
+            meta, rows, ended, bad = parse_data_csv(path)
+            entry.update(rows=len(rows), ended=ended, bad_rows=bad, master=meta.get('Master_CSV_Used', ''))
+            if not os.path.exists(part + ".npz"):
+                mvast3.write_columns(part, mvast3.session_columns_from_rows(rows), meta, parquet=False)
+        else:
+            cols, meta = parse_summary_csv(path)
+            entry.update(rows=1)
+            if not os.path.exists(part + ".npz"): mvast3.write_columns(part, cols, meta, parquet=False)
+        entry['part'] = os.path.basename(part) + ".npz"
+    except (OSError, ValueError, KeyError, csv.Error) as e: entry['error'] = f"{type(e).__name__}: {e}"
+    return entry
+
+# --- Cohort Assembly ---
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(path) as f: manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION: return manifest
+    except (OSError, ValueError): pass
+    return {'version': MANIFEST_VERSION, 'files': {}}
+
+def find_sources(runs_dir):
+    found = {}
+    for kind, pattern in (("data", DATA_GLOB), ("summary", SUMMARY_GLOB)):
+        for path in glob.glob(os.path.join(runs_dir, "**", pattern), recursive=True):
+            found[os.path.relpath(path, runs_dir)] = kind
+    return found
+
+def journal_statuses(runs_dir):
+    """ data file name -> (journal status, whether it is the last segment of its session). """
+    out = {}
+    for path in glob.glob(os.path.join(runs_dir, "**", JOURNAL_GLOB), recursive=True):
+        try: state = mvast3.SessionJournal.read(path)
+        except (OSError, KeyError, ValueError) as e: print(f"Skipping unreadable journal {path}: {e}"); continue
+        if not state: continue
+        for i, name in enumerate(state['data_files']):
+            out[name] = (state['status'], i == len(state['data_files']) - 1)
+    return out
+
+def session_status(entry, journal, expected_rows):
+    """ For files a journal lists: a segment that was later resumed is partial, the last one is complete, partial
+    (stopped, with its closing row) or aborted (crashed and never resumed). Older files without a journal are judged
+    by their closing row and trial count. """
+    if journal:
+        status, last = journal
+        if not last: return STATUS_PARTIAL
+        if status == 'complete': return STATUS_COMPLETE
+        return STATUS_PARTIAL if entry.get('ended') else STATUS_ABORTED
+    if not entry.get('ended') or entry.get('bad_rows'): return STATUS_ABORTED
+    return STATUS_COMPLETE if entry['rows'] >= expected_rows.get(entry.get('master', ''), 0) else STATUS_PARTIAL
+
+def build_tables(runs_dir, output_dir, files, parquet=True):
+    """ Concatenates the parsed parts into cohort_trials and cohort_summaries; each trial row carries its session's file,
+    status, segment and start time so partial and aborted sessions stay in the table, flagged. """
+    parts_dir = os.path.join(output_dir, PARTS_SUBDIR)
+    journals = journal_statuses(runs_dir)
+    expected = {} # trials in the longest ended session per master CSV, for sessions that predate journals
+    for e in files.values():
+        if e['kind'] == "data" and e.get('ended'): expected[e['master']] = max(expected.get(e['master'], 0), e['rows'])
+    trials, summaries, statuses = [], [], {}
+    for rel, e in sorted(files.items()):
+        if 'part' not in e: continue
+        if e['kind'] == "summary":
+            cols, meta = mvast3.read_columns(os.path.join(parts_dir, e['part']))
+            cols['Summary_File'] = np.array([rel]); summaries.append(cols); continue
+        cols, meta = mvast3.load_session_columns(os.path.join(parts_dir, e['part']))
+        status = statuses[rel] = session_status(e, journals.get(os.path.basename(rel)), expected)
+        n = len(cols['Trial_Number_Overall'])
+        for key, value in (('Session_File', rel), ('Session_Status', status), ('Session_Segment', meta.get('Session_Segment', '1')),
+                           ('Timestamp_Start_Run', meta.get('Timestamp_Start_Run', ''))):
+            cols[key] = np.array([value] * n, dtype=str)
+        trials.append(cols)
+    info = {'generated': datetime.now().isoformat(timespec='seconds'), 'runs_dir': os.path.abspath(runs_dir),
+            'sessions': len(statuses), 'summaries': len(summaries),
+            'status_counts': {s: list(statuses.values()).count(s) for s in (STATUS_COMPLETE, STATUS_PARTIAL, STATUS_ABORTED)}}
+    written = []
+    for name, tables in (("cohort_trials", trials), ("cohort_summaries", summaries)):
+        if not tables: continue
+        cols = {key: np.concatenate([t[key] for t in tables]) for key in tables[0]}
+        written.append(mvast3.write_columns(os.path.join(output_dir, name), cols, info, parquet))
+    return info, written
+
+def ingest(runs_dir, output_dir, workers=None, full=False, parquet=True):
+    """ Parses new or changed files (by size, mtime and content hash) across a process pool, updates the manifest and
+    rebuilds the cohort tables from the per-file parts. """
+    t0 = time.perf_counter()
+    parts_dir = os.path.join(output_dir, PARTS_SUBDIR)
+    os.makedirs(parts_dir, exist_ok=True)
+    manifest = {'version': MANIFEST_VERSION, 'files': {}} if full else load_manifest(output_dir)
+    sources, known = find_sources(runs_dir), manifest['files']
+    todo = []
+    for rel, kind in sorted(sources.items()):
+        st, e = os.stat(os.path.join(runs_dir, rel)), known.get(rel)
+        if e and 'part' in e and e['size'] == st.st_size and e['mtime_ns'] == st.st_mtime_ns: continue
+        todo.append((rel, kind))
+    files = {rel: e for rel, e in known.items() if rel in sources}
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {rel: pool.submit(ingest_file, os.path.join(runs_dir, rel), kind, parts_dir) for rel, kind in todo}
+            for rel, fut in futures.items():
+                files[rel] = fut.result()
+                if 'error' in files[rel]: print(f"Could not parse {rel}: {files[rel]['error']}")
+    manifest['files'] = files
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f: json.dump(manifest, f, indent=1)
+    live = {e['part'] for e in files.values() if 'part' in e}
+    for stale in set(os.listdir(parts_dir)) - live: os.remove(os.path.join(parts_dir, stale))
+    info, written = build_tables(runs_dir, output_dir, files, parquet)
+    print(f"{len(sources)} files ({len(todo)} parsed, {len(sources) - len(todo)} unchanged) in {time.perf_counter() - t0:.1f} s; "
+          f"sessions: " + ", ".join(f"{n} {s}" for s, n in info['status_counts'].items()) + ".")
+    for path in written: print(f"Wrote {path}")
+    return info
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="mvast3_cohort.py", description="Combine M-VAST 3 participant runs into cohort tables.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ing = sub.add_parser("ingest", help="Parse new/changed run files and rebuild the cohort tables.")
+    ing.add_argument("runs_dir", nargs="?", default=DEFAULT_RUNS_DIR)
+    ing.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="Folder for the cohort tables, manifest and parsed parts.")
+    ing.add_argument("--workers", type=int, default=None, help="Parser processes (default: one per CPU).")
+    ing.add_argument("--full", action="store_true", help="Ignore the manifest and re-parse every file.")
+    ing.add_argument("--npz", action="store_true", help="Write .npz even when pyarrow is installed.")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.runs_dir): parser.error(f"not a folder: {args.runs_dir}")
+    ingest(args.runs_dir, args.output, args.workers, args.full, not args.npz)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())